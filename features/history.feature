@@ -24,4 +24,10 @@ Feature: Commiting Changes
   Scenario: Committing Modify Commands
     Given A repository with some files in it
     When I commit some modify commands
-    Then The repository records the modifications to the files
\ No newline at end of file
+    Then The repository records the modifications to the files
+
+  @database
+  Scenario: Searching Annotations
+    Given A repository with some files in it
+    When I commit an annotated revision
+    Then Searching finds the revisions that match
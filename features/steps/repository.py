@@ -2,7 +2,7 @@ import json
 from behave import given, when, then
 from hamcrest import assert_that, is_, is_in
 from version_history.connection import Statement
-from version_history.history import History
+from version_history.history import History, SCHEMA_VERSION
 
 
 @given("An empty repository")
@@ -18,13 +18,14 @@ def commit_add_commands(context):
     dir_id_b = context.repository.create_file(filename="Directory B", type='directory')
 
     # Create two other files within the new folder
-    file_id_c = context.repository.create_file(filename="File C", content=b"Some other content", type='file')
-    file_id_d = context.repository.create_file(filename="File D", content=b"Still more content", type='file')
+    file_id_c = context.repository.create_file(dir_id_b, filename="File C", content=b"Some other content", type='file')
+    file_id_d = context.repository.create_file(dir_id_b, filename="File D", content=b"Still more content", type='file')
 
     # Create a directory inside the new directory and put a file in there
-    dir_id_e = context.repository.create_file(filename="Directory E", type='directory')
-    file_id_f = context.repository.create_file(filename="File F", content=b"Interior stuff", type='file')
+    dir_id_e = context.repository.create_file(dir_id_b, filename="Directory E", type='directory')
+    file_id_f = context.repository.create_file(dir_id_e, filename="File F", content=b"Interior stuff", type='file')
     context.this_rev, mapping = context.repository.commit(context.first_rev)
+    assert_that(context.repository.head, is_(context.this_rev), "The cached head followed the commit")
     context.mapping = {
         "A": mapping[file_id_a],
         "B": mapping[dir_id_b],
@@ -84,6 +85,26 @@ def check_for_added_files(context):
     assert_that(command_mapping["Directory E"]['type'], is_("create"))
     assert_that(command_mapping["File F"]['type'], is_("create"))
 
+    # Make sure that the directory structure was recorded
+    paths = {entity[1]['path']: entity[0] for entity in entities}
+    assert_that(paths, is_({
+        "/File A": context.mapping["A"],
+        "/Directory B": context.mapping["B"],
+        "/Directory B/File C": context.mapping["C"],
+        "/Directory B/File D": context.mapping["D"],
+        "/Directory B/Directory E": context.mapping["E"],
+        "/Directory B/Directory E/File F": context.mapping["F"],
+    }))
+    assert_that(context.repository.subtree("/Directory B"),
+                is_([(context.mapping["E"], "/Directory B/Directory E"),
+                     (context.mapping["F"], "/Directory B/Directory E/File F"),
+                     (context.mapping["C"], "/Directory B/File C"),
+                     (context.mapping["D"], "/Directory B/File D")]))
+    assert_that(context.repository.children(context.mapping["B"]),
+                is_([(context.mapping["E"], "Directory E"),
+                     (context.mapping["C"], "File C"),
+                     (context.mapping["D"], "File D")]))
+
     # Ensure that the commands are associated with the previous revision id
     commands_associated = context.connection.post(Statement("MATCH (c:COMMAND) -[:OCCURRED]-> "
                                                             "(r:REVISION) WHERE id(r) = {} RETURN c"
@@ -121,12 +142,15 @@ def repository_is_initialized(context):
     """
     result = context.connection.post(Statement("MATCH (r:REVISION) return r, id(r)"),
                                      Statement('MATCH (h:BRANCH {name: "head"}) return h, id(h)'),
-                                     Statement("MATCH (n) return n"))
+                                     Statement("MATCH (n) return n"),
+                                     Statement("MATCH (r:REPOSITORY) return r.schema_version"))
 
-    assert_that(len(result), is_(3), "We found both the first revision and the root file entity")
+    assert_that(len(result), is_(4), "We found both the first revision and the root file entity")
     assert_that(len(result[0]['data']), is_(1), "There was only one revision")
     assert_that(len(result[1]['data']), is_(1), "There was only one head")
-    assert_that(len(result[2]['data']), is_(2), "There was only two nodes: the revision and the head")
+    assert_that(len(result[2]['data']), is_(3), "There were only three nodes: the revision, the head and the repository")
+    assert_that(result[3]['data'][0]['row'][0], is_(SCHEMA_VERSION), "The schema version was recorded")
+    assert_that(context.repository.head, is_(result[0]['data'][0]['row'][1]), "The head revision was cached")
 
 
 @given("A repository with some files in it")
@@ -161,6 +185,7 @@ def check_for_deleted_files(context):
                                                  .format(context.old_rev)))[0]['data']
 
     assert_that(len(commands), is_(2))
+    assert_that(context.repository.subtree("/Directory B/Directory E"), is_([]), "Deleted files leave the subtree")
     assert_that(commands[0]['row'][0]['type'], is_("delete"), "We associated a delete command with the revision")
     assert_that(commands[1]['row'][0]['type'], is_("delete"), "We associated a delete command with the revision")
 
@@ -207,7 +232,40 @@ def check_for_modified_files(context):
     assert_that(data, is_({'{"content":"U29tZSBvdGhlciBjb250ZW50","filename":"File C","type":"file"}',
                            '{"content":"U3RpbGwgbW9yZSBjb250ZW50","filename":"File D","type":"file"}'}))
 
+    assert_that(context.repository.file_content(context.mapping["C"]), is_(b"Some wdsother content"))
+    assert_that(context.repository.file_content(context.mapping["D"]), is_(b"Stre content"))
+    assert_that(context.repository.file_content(context.mapping["B"]), is_(b""), "Directories have no content")
+
     long_ops = context.connection.post(Statement("MATCH p = (c:COMMAND) -[:FIRST_OP]-> "
                                                  "(o1:OPERATION) -[:NEXT_OP]-> (o2:OPERATION) return p"))[0]
     print()
     print(long_ops)
+
+
+@when("I commit an annotated revision")
+def commit_annotated_revision(context):
+    """
+    :type context behave.runner.Context
+    """
+    context.repository.annotate("Removed the outliers from the centrifuge trial")
+    context.repository.create_file(filename="Centrifuge Notes", type='notes')
+    context.old_rev = context.this_rev
+    context.this_rev, _ = context.repository.commit(context.this_rev)
+
+
+@then("Searching finds the revisions that match")
+def check_search(context):
+    """
+    :type context behave.runner.Context
+    """
+    hits = context.repository.search("centrifuge outliers")
+    assert_that(len(hits), is_(1), "Only the annotated revision matches")
+    assert_that(hits[0][0], is_(context.old_rev), "The hit is the revision the commands occurred in")
+    assert_that(hits[0][2], is_("Removed the outliers from the centrifuge trial"))
+
+    hits = context.repository.search("file")
+    assert_that(len(hits), is_(1), "Filenames are indexed")
+    assert_that(hits[0][0], is_(context.first_rev))
+
+    assert_that(context.repository.search("file", skip=1), is_([]), "Hits can be paged through")
+    assert_that(context.repository.search("nonexistent"), is_([]))
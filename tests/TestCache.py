@@ -0,0 +1,46 @@
+import unittest
+from version_history.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"), "The least recently used value was evicted")
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.evictions)
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", b"aaaa", 4)
+        cache.put("b", b"bbbb", 4)
+        cache.put("c", b"cccc", 4)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(b"cccc", cache.get("c"))
+        cache.put("d", b"d" * 11, 11)
+        self.assertIsNone(cache.get("d"), "Values larger than the cache are never stored")
+        self.assertEqual(8, cache.statistics()["bytes"])
+
+        cache.put("c", b"cc", 2)
+        self.assertEqual(6, cache.statistics()["bytes"], "Replacing a value replaces its size")
+
+    def test_statistics(self):
+        cache = LRUCache()
+        self.assertEqual(0.0, cache.hit_rate)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        self.assertDictEqual({"entries": 1, "bytes": 0, "hits": 3, "misses": 1, "evictions": 0, "hit_rate": 0.75},
+                             cache.statistics())
+
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+        cache.put("b", 2)
+        cache.clear()
+        self.assertEqual(0, cache.statistics()["entries"])
@@ -0,0 +1,23 @@
+import unittest
+from version_history.columnar import to_columns
+
+
+class TestColumnar(unittest.TestCase):
+    def test_to_columns(self):
+        columns = to_columns({
+            "columns": ["r", "id(r)", "r.weight", "r.count", "r.friendly"],
+            "data": [
+                {"row": [{"name": "Bob"}, 15, 1.5, 3, True]},
+                {"row": [{"name": "Alice"}, 16, 2, None, False]},
+            ],
+        })
+        self.assertEqual([{"name": "Bob"}, {"name": "Alice"}], columns["r"])
+        self.assertEqual([15, 16], list(columns["id(r)"]))
+        self.assertNotIsInstance(columns["id(r)"], list, "Integer columns are typed arrays")
+        self.assertEqual([1.5, 2.0], list(columns["r.weight"]))
+        self.assertIsInstance(columns["r.count"], list, "Columns with missing values are left as lists")
+        self.assertEqual([True, False], columns["r.friendly"])
+
+    def test_empty_result(self):
+        columns = to_columns({"columns": ["id(r)"], "data": []})
+        self.assertEqual(0, len(columns["id(r)"]))
@@ -0,0 +1,25 @@
+import unittest
+from version_history import compression
+
+
+class TestCompression(unittest.TestCase):
+    def test_small_payloads_are_left_alone(self):
+        self.assertEqual(('{"filename":"File A"}', None), compression.compress('{"filename":"File A"}'))
+
+    def test_round_trip(self):
+        text = '{"notes":"' + "The sample was centrifuged for ten minutes. " * 100 + '"}'
+        payload, codec = compression.compress(text)
+        self.assertEqual("zlib", codec)
+        self.assertLess(len(payload), len(text))
+        self.assertEqual(text, compression.decompress(payload, codec))
+
+    def test_decode_properties(self):
+        text = "words " * 500
+        payload, codec = compression.compress(text, threshold=10)
+        self.assertDictEqual({'type': 'insert', 'content': text, 'location': 5},
+                             compression.decode_properties({'type': 'insert', 'content': payload, 'location': 5,
+                                                            'codec': codec}, 'content'))
+        self.assertDictEqual({'type': 'delete'}, compression.decode_properties({'type': 'delete'}, 'data'))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, compression.compress, "words " * 500, "lzma")
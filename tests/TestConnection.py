@@ -1,6 +1,7 @@
-from io import StringIO
+from hashlib import sha256
+from io import BytesIO, StringIO
 import unittest
-from version_history.connection import Connection, Statement
+from version_history.connection import Connection, Statement, StreamedContent
 
 
 def add_dummy_data(connection):
@@ -62,6 +63,18 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(result[0][1]['name'], "Bob")
         self.assertEqual(result[0][1]['friendly'], True)
 
+    def test_find_columnar(self):
+        add_dummy_data(self.connection)
+        result = self.connection.find_columnar("PERSON", properties=["name", "friendly"])
+        self.assertEqual(["id", "name", "friendly"], list(result.keys()))
+        self.assertEqual(3, len(result["id"]))
+        self.assertEqual({"Alice", "Bob", "Eve"}, set(result["name"]))
+        self.assertEqual(sorted(node_id for node_id, _ in self.connection.find("PERSON")), sorted(result["id"]))
+
+        result = self.connection.find_columnar("PERSON", {'name': "Eve"})
+        self.assertEqual(["id"], list(result.keys()))
+        self.assertEqual(1, len(result["id"]))
+
 
 class TestStatement(unittest.TestCase):
     def test_write_json(self):
@@ -87,3 +100,16 @@ class TestStatement(unittest.TestCase):
         self.assertEqual('{"statement":"CREATE ({ props })",' +
                          '"parameters":{"props":{"name":"Andres","position":"Developer"}}}',
                          output.getvalue())
+
+    def test_write_json_streams(self):
+        content = StreamedContent(BytesIO(b"This is the file's content"), chunk_size=4)
+        output = StringIO()
+        Statement("CREATE ({ props })", {"props": {"data": '{"content":"@@stream:a@@"}'}},
+                  {"@@stream:a@@": content}).write_json(output)
+        self.assertEqual('{"statement":"CREATE ({ props })",' +
+                         '"parameters":{"props":{"data":"{\\"content\\":\\"VGhpcyBpcyB0aGUgZmlsZSdzIGNvbnRlbnQ=\\"}"}}}',
+                         output.getvalue())
+
+        # The content can be read more than once
+        self.assertEqual(b"This is the file's content", b"".join(content.iter_chunks()))
+        self.assertEqual((sha256(b"This is the file's content").hexdigest(), 26), content.sha256())
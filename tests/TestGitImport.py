@@ -0,0 +1,120 @@
+from io import BytesIO
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+import unittest
+from version_history.connection import Connection
+from version_history.git_import import GitImporter, _operations, _read_commits
+from version_history.history import History
+
+
+def apply_operations(text, operations):
+    for operation in operations:
+        location = operation['location']
+        if operation['type'] == 'insert':
+            text = text[:location] + operation['content'] + text[location:]
+        else:
+            text = text[:location] + text[location + operation['length']:]
+    return text
+
+
+class TestOperations(unittest.TestCase):
+    def test_operations(self):
+        old = "first line\nsecond line\nthird line\n"
+        new = "first line\nchanged line\nthird line\nfourth line\n"
+        operations = _operations(old.encode("utf-8"), new.encode("utf-8"))
+        self.assertEqual([{'type': 'remove', 'length': 12, 'location': 11},
+                          {'type': 'insert', 'content': "changed line\n", 'location': 11},
+                          {'type': 'insert', 'content': "fourth line\n", 'location': 35}], operations)
+        self.assertEqual(new, apply_operations(old, operations))
+        self.assertEqual([], _operations(b"same\n", b"same\n"))
+        self.assertIsNone(_operations(b"\xff\xfe", b"text"))
+
+    def test_read_commits(self):
+        stream = BytesIO(b'reset refs/heads/master\n'
+                         b'commit refs/heads/master\n'
+                         b'mark :1\n'
+                         b'original-oid 9b87fea76670340f273533ebf9fb1c986d5082f8\n'
+                         b'author a <a@b> 1792405982 +0000\n'
+                         b'committer a <a@b> 1792405982 +0000\n'
+                         b'data 11\n'
+                         b'first\nbody\n'
+                         b'M 100644 45b983be36b73c0788dc9cbcb76cbb80fc7bb057 d/a.txt\n'
+                         b'M 100644 587be6b4c3f93f93c489c0111bba5596147a26cb "sp\\303\\251ce.txt"\n'
+                         b'M 160000 e2ef35127e993ca4422390ae240db7c283d2cd4d module\n'
+                         b'D old.txt\n'
+                         b'\n')
+        commits = list(_read_commits(stream))
+        self.assertEqual(1, len(commits))
+        self.assertEqual("9b87fea76670340f273533ebf9fb1c986d5082f8", commits[0].commit_id)
+        self.assertEqual("first\nbody\n", commits[0].message)
+        self.assertEqual([("M", "d/a.txt", "45b983be36b73c0788dc9cbcb76cbb80fc7bb057"),
+                          ("M", "spéce.txt", "587be6b4c3f93f93c489c0111bba5596147a26cb"),
+                          ("D", "old.txt")], commits[0].changes)
+
+
+class TestGitFailures(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_not_a_repository(self):
+        self.assertRaises(subprocess.CalledProcessError, GitImporter(None, self.directory.name).run)
+
+    def test_bad_ref(self):
+        subprocess.run(["git", "init", "-q"], cwd=self.directory.name, check=True)
+        self.assertRaises(subprocess.CalledProcessError, GitImporter(None, self.directory.name).run, "no-such-ref")
+
+
+class TestGitImporter(unittest.TestCase):
+    def setUp(self):
+        self.connection = Connection("neo4j", "password")
+        self.connection.clear_database()
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def git(self, *arguments):
+        subprocess.check_call(["git", "-c", "user.name=Test", "-c", "user.email=test@example.com"] + list(arguments),
+                              cwd=self.directory.name, stdout=subprocess.DEVNULL)
+
+    def write(self, path, text):
+        with open(self.directory.name + "/" + path, "w") as writer:
+            writer.write(text)
+
+    def test_import(self):
+        self.git("init", "-q")
+        self.write("notes.txt", "first line\n")
+        self.git("add", ".")
+        self.git("commit", "-qm", "Add notes")
+        self.write("notes.txt", "first line\nsecond line\n")
+        self.write("results.csv", "1,2\n")
+        self.git("add", ".")
+        self.git("commit", "-qm", "Record results")
+        self.git("rm", "-q", "results.csv")
+        self.git("commit", "-qm", "Discard results")
+
+        history = History(self.connection)
+        imported = GitImporter(history, self.directory.name, batch_size=2, workers=2).run()
+        self.assertEqual(3, len(imported))
+        self.assertEqual(max(imported.values()), history.head)
+        self.assertEqual(["Record results\n"], [annotation for _, _, annotation in history.search("record")])
+        self.assertEqual(["/notes.txt"], [path for _, path in history.subtree("/")])
+
+    def test_remove_directory(self):
+        self.git("init", "-q")
+        os.makedirs(self.directory.name + "/data/raw")
+        self.write("data/raw/trial.csv", "1,2\n")
+        self.write("data/summary.txt", "nothing yet\n")
+        self.write("notes.txt", "first line\n")
+        self.git("add", ".")
+        self.git("commit", "-qm", "Add data")
+        self.git("rm", "-rq", "data")
+        self.git("commit", "-qm", "Discard data")
+
+        history = History(self.connection)
+        GitImporter(history, self.directory.name, workers=1).run()
+        self.assertEqual(["/notes.txt"], [path for _, path in history.subtree("/")])
@@ -0,0 +1,43 @@
+from threading import Thread
+import unittest
+from version_history.connection import Connection, Statement
+from version_history.group_commit import GroupCommitter
+from version_history.history import History
+
+
+class TestGroupCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = Connection("neo4j", "password")
+        self.connection.clear_database()
+
+    def test_concurrent_commits(self):
+        # Initialize the repository before any of the producers look for it
+        History(self.connection)
+        committer = GroupCommitter(self.connection, window=0.05, max_revisions=4)
+        results = {}
+
+        def produce(name):
+            history = History(self.connection)
+            temp_id = history.create_file(filename=name, type='file')
+            revision, mapping = committer.commit(history)
+            results[name] = (revision, mapping[temp_id])
+
+        names = ["File {}".format(index) for index in range(10)]
+        producers = [Thread(target=produce, args=(name,)) for name in names]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+
+        self.assertEqual(set(names), set(results.keys()))
+        self.assertEqual(10, len({revision for revision, _ in results.values()}))
+        self.assertEqual(10, len(self.connection.find("FILE_ENTITY")))
+
+        # Every revision should have been chained onto the one before it
+        chain = self.connection.post(Statement("MATCH p = (first:REVISION) -[:NEXT_COMMAND*]-> "
+                                               "(:REVISION) -[:AT]-> (:BRANCH {name: 'head'}) "
+                                               "WHERE NOT (:REVISION) -[:NEXT_COMMAND]-> (first) "
+                                               "RETURN length(p)"))[0]['data']
+        self.assertEqual(1, len(chain))
+        self.assertEqual(10, chain[0]['row'][0])
@@ -1,5 +1,6 @@
 import json
 from py2neo.core import Node
+from version_history.cache import LRUCache
 from version_history.connection import Connection
 from version_history.history import History
 
@@ -19,3 +20,73 @@ class TestHistory(unittest.TestCase):
         # Check if the database looks right
         operations = []
 
+
+    def test_startup_handshake(self):
+        connection = Connection("neo4j", "password")
+        connection.clear_database()
+        history = History(connection)
+        self.assertEqual(1, len(history.branches))
+        self.assertEqual(connection.find("REVISION")[0][0], history.head)
+
+        history.create_file(filename="File A", type='file')
+        revision, _ = history.commit()
+        self.assertEqual(revision, history.head)
+
+        # A fresh history should pick up the same metadata without any further work
+        reopened = History(connection)
+        self.assertEqual({"head": revision}, reopened.branches)
+        self.assertEqual(history.schema_version, reopened.schema_version)
+
+    def test_read_through_cache(self):
+        connection = Connection("neo4j", "password")
+        connection.clear_database()
+        history = History(connection, cache=LRUCache())
+        first_revision = history.head
+        file_id = history.create_file(filename="File A", content=b"This is the file's content", type='file')
+        mapping = history.commit()[1]
+
+        self.assertEqual([], history.revision_commands(history.head), "The tip of the branch has no commands")
+        commands = history.revision_commands(first_revision)
+        self.assertEqual(1, len(commands))
+        self.assertIs(commands, history.revision_commands(first_revision))
+        self.assertEqual(b"This is the file's content", history.file_content(mapping[file_id]))
+        self.assertEqual(b"This is the file's content", history.file_content(mapping[file_id], commands[0][0]))
+        self.assertEqual(b"This is the file's content", history.file_content(mapping[file_id]))
+        self.assertEqual({"entries": 3, "hits": 4, "misses": 4},
+                         {key: history.cache.statistics()[key] for key in ("entries", "hits", "misses")})
+
+        # Moving the head branch discards the latest command, but not the content as of the old one
+        history.modify_file(mapping[file_id], {'type': 'insert', 'content': 'new ', 'location': 12})
+        history.commit()
+        self.assertEqual(b"This is the new file's content", history.file_content(mapping[file_id]))
+        self.assertEqual(4, history.cache.statistics()["entries"])
+
+    def test_file_content_after_delete(self):
+        connection = Connection("neo4j", "password")
+        connection.clear_database()
+        history = History(connection)
+        temp_id = history.create_file(filename="File A", content=b"This is the file's content", type='file')
+        file_id = history.commit()[1][temp_id]
+        history.delete_file(file_id)
+        history.commit()
+        self.assertIsNone(history.file_content(file_id))
+
+        history.modify_file(file_id, {'type': 'insert', 'content': 'words', 'location': 5})
+        history.commit()
+        self.assertRaises(ValueError, history.file_content, file_id)
+
+    def test_create_file_parent(self):
+        connection = Connection("neo4j", "password")
+        connection.clear_database()
+        history = History(connection)
+        first_revision = history.head
+        unnamed_id = history.create_file(type='directory')
+        history.create_file(filename="File A", parent="Kept as data", type='file')
+        mapping = history.commit()[1]
+
+        data = [json.loads(properties['data']) for _, _, properties, _ in history.revision_commands(first_revision)]
+        self.assertIn({"filename": "File A", "parent": "Kept as data", "type": "file"}, data)
+        self.assertEqual("/File A", connection.find("FILE_ENTITY", {"name": "File A"})[0][1]['path'])
+
+        # A directory without a filename has no path, so files within it couldn't be given one
+        self.assertRaises(ValueError, history.create_file, mapping[unnamed_id], filename="File B")
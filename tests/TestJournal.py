@@ -0,0 +1,123 @@
+from io import BytesIO
+from tempfile import TemporaryDirectory
+import unittest
+from version_history.connection import Connection
+from version_history.history import History
+from version_history.journal import Journal, Syncer
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reopen(self):
+        journal = Journal(self.directory.name)
+        file_id = journal.create_file(filename="File A", content=b"This is the file's content", type='file')
+        journal.create_file(filename="File B", content=BytesIO(b"Streamed content"), type='file')
+        self.assertEqual((1, {"temp_1": "j1_temp_1", "temp_2": "j1_temp_2"}), journal.commit())
+        journal.modify_file(file_id, {'type': 'insert', 'content': 'words', 'location': 5})
+        self.assertEqual((2, {}), journal.commit())
+        journal.close()
+
+        journal = Journal(self.directory.name)
+        unsynced = journal.unsynced()
+        self.assertEqual([1, 2], [record["sequence"] for record in unsynced])
+        self.assertEqual(b"This is the file's content", unsynced[0]["commands"][0]["data"]["content"])
+        self.assertEqual({"$blob": "blobs/j1_temp_2_content"}, unsynced[0]["commands"][1]["data"]["content"])
+        self.assertIsNone(journal.resolve(file_id))
+
+        journal.mark_synced(1, 42, {"j1_temp_1": 43, "j1_temp_2": 44})
+        journal.close()
+
+        journal = Journal(self.directory.name)
+        self.assertEqual([2], [record["sequence"] for record in journal.unsynced()])
+        self.assertEqual(43, journal.resolve(file_id))
+        self.assertEqual([], list((journal.directory / "blobs").iterdir()))
+        self.assertEqual("j3_temp_1", journal.create_file(filename="File C"))
+        journal.close()
+
+    def test_torn_record(self):
+        journal = Journal(self.directory.name)
+        journal.create_file(filename="File A", type='file')
+        journal.commit()
+        journal.close()
+        with open(journal.directory / "journal.log", "a", encoding="utf-8") as log:
+            log.write('{"branch":"head","commands":[')
+
+        journal = Journal(self.directory.name)
+        self.assertEqual([1], [record["sequence"] for record in journal.unsynced()])
+        journal.annotate("After the crash")
+        self.assertEqual((2, {}), journal.commit())
+        journal.close()
+
+        journal = Journal(self.directory.name)
+        self.assertEqual([1, 2], [record["sequence"] for record in journal.unsynced()])
+        journal.close()
+
+
+class LossyConnection(Connection):
+    def __init__(self, *args):
+        """
+        A connection that loses the response to its next transaction that writes, after the database has committed it
+        """
+        super().__init__(*args)
+        self.lose_response = False
+
+    def _send(self, statements, body):
+        result = super()._send(statements, body)
+        if self.lose_response and any("CREATE" in statement.statement for statement in statements):
+            self.lose_response = False
+            raise ConnectionError("The response was lost")
+        return result
+
+
+class TestSyncer(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.connection = Connection("neo4j", "password")
+        self.connection.clear_database()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sync(self):
+        journal = Journal(self.directory.name)
+        directory_id = journal.create_file(filename="Directory B", type='directory')
+        file_id = journal.create_file(directory_id, filename="File C", content=b"Some other content", type='file')
+        journal.commit()
+        journal.modify_file(file_id, {'type': 'insert', 'content': 'words', 'location': 5})
+        journal.commit()
+        journal.delete_file(directory_id)
+        journal.commit()
+
+        history = History(self.connection)
+        self.assertEqual(3, Syncer(journal, history).sync())
+        self.assertEqual([], journal.unsynced())
+        self.assertEqual(2, len(self.connection.find("FILE_ENTITY")))
+        self.assertEqual([(journal.resolve(file_id), "/Directory B/File C")],
+                         history.subtree("/Directory B", include_deleted=True))
+        self.assertEqual(0, Syncer(journal, history).sync())
+        journal.close()
+
+    def test_lost_response(self):
+        journal = Journal(self.directory.name)
+        file_id = journal.create_file(filename="File A", content=b"This is the file's content", type='file')
+        journal.commit()
+        journal.annotate("Nothing created")
+        journal.commit()
+
+        connection = LossyConnection("neo4j", "password")
+        syncer = Syncer(journal, History(connection))
+        connection.lose_response = True
+        self.assertRaises(ConnectionError, syncer.sync)
+        self.assertEqual(2, len(journal.unsynced()))
+
+        # The revisions are already in the database, so they are marked as synced rather than sent again
+        self.assertEqual(2, syncer.sync())
+        self.assertEqual([], journal.unsynced())
+        self.assertEqual(1, len(self.connection.find("FILE_ENTITY")))
+        self.assertEqual(self.connection.find("FILE_ENTITY")[0][0], journal.resolve(file_id))
+        journal.close()
@@ -0,0 +1,44 @@
+import unittest
+from version_history.connection import Statement
+from version_history.profiling import Profiler
+
+
+def plan(operator, db_hits, rows, *children):
+    return {"operatorType": operator, "DbHits": db_hits, "Rows": rows, "children": list(children)}
+
+
+class TestProfiler(unittest.TestCase):
+    def test_prepare(self):
+        profiler = Profiler()
+        prepared = profiler.prepare(Statement("MATCH (n) RETURN n", operation="find"))
+        self.assertEqual("PROFILE MATCH (n) RETURN n", prepared.statement)
+        self.assertEqual("find", prepared.operation)
+
+        schema = Statement("CREATE INDEX ON :TERM(text)", operation="schema")
+        self.assertIs(schema, profiler.prepare(schema))
+
+        self.assertRaises(ValueError, Profiler, "ANALYZE")
+
+    def test_report(self):
+        profiler = Profiler()
+        for revision in (15, 23):
+            profiler.record(Statement("MATCH (old_rev:REVISION) WHERE id(old_rev) = {} CREATE (n:REVISION)"
+                                      .format(revision), operation="advance branch"),
+                            {"data": [], "plan": {"root": plan("EmptyResult", 0, 0,
+                                                               plan("CreateNode", 2, 1,
+                                                                    plan("NodeByIdSeek", 1, 1)))}})
+        profiler.record(Statement("MATCH (n) RETURN n"), {"data": []})
+
+        report = profiler.report()
+        self.assertEqual(["advance branch"], list(report.keys()))
+        self.assertEqual(2, report["advance branch"]["statements"])
+        self.assertEqual(6, report["advance branch"]["db_hits"])
+        self.assertDictEqual({"EmptyResult": 0, "CreateNode": 4, "NodeByIdSeek": 2},
+                             report["advance branch"]["operators"])
+        self.assertDictEqual({"MATCH (old_rev:REVISION) WHERE id(old_rev) = ? CREATE (n:REVISION)":
+                              {"statements": 2, "db_hits": 6}}, report["advance branch"]["templates"])
+        self.assertTrue(profiler.format_report().startswith("advance branch: 2 statements, 6 db hits, 0 rows\n"
+                                                            "    CreateNode: 4 db hits\n"))
+
+        profiler.reset()
+        self.assertDictEqual({}, profiler.report())
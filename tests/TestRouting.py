@@ -0,0 +1,146 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from threading import Thread
+import time
+import unittest
+from version_history.connection import Statement
+from version_history.routing import RoutingConnection
+
+
+class StubServer(HTTPServer):
+    def __init__(self, name):
+        """
+        Stands in for one member of a cluster.  Every statement returns a single row naming the member.
+        """
+        super().__init__(("localhost", 0), StubHandler)
+        self.name = name
+        self.leader = False
+        self.statements = []
+        #: How the member answers transactions: "ok", "unavailable" for a 503, "hang up" to drop the connection
+        #: once the request has been read, or "slow" to take a second over it
+        self.behaviour = "ok"
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self):
+        return "localhost", self.server_address[1]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond(200 if self.server.leader else 404, "true" if self.server.leader else "false")
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = self._read_chunked()
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        statements = json.loads(body + "}")["statements"]
+        self.server.statements.extend(statement["statement"] for statement in statements)
+        if self.server.behaviour == "unavailable":
+            self._respond(503, "<html>Unavailable</html>")
+            return
+        if self.server.behaviour == "slow":
+            time.sleep(1)
+        if self.server.behaviour == "hang up":
+            self.close_connection = True
+            return
+        self._respond(200, json.dumps({"results": [{"columns": ["server"], "data": [{"row": [self.server.name]}]}
+                                                   for _ in statements], "errors": []}))
+
+    def _read_chunked(self):
+        body = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if size == 0:
+                return body.decode("utf-8")
+
+    def _respond(self, status, text):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRoutingConnection(unittest.TestCase):
+    def setUp(self):
+        self.servers = [StubServer(name) for name in ("a", "b", "c")]
+        self.servers[0].leader = True
+        self.connection = RoutingConnection("neo4j", "password", [server.endpoint for server in self.servers],
+                                            retry_interval=60)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def read(self):
+        return self.connection.post(Statement("MATCH (n) RETURN n"))[0]['data'][0]['row'][0]
+
+    def write(self):
+        return self.connection.post(Statement("CREATE (n) RETURN n"))[0]['data'][0]['row'][0]
+
+    def test_routing(self):
+        self.assertEqual(("localhost", self.servers[0].endpoint[1]), self.connection.check_health())
+        self.assertEqual(["b", "c", "b", "c"], [self.read() for _ in range(4)])
+        self.assertEqual(["a", "a"], [self.write() for _ in range(2)])
+
+        # Read only statements can still be mixed with writes
+        self.assertEqual("a", self.connection.post(Statement("MATCH (n) RETURN n"),
+                                                   Statement("MATCH (n) DELETE n"))[0]['data'][0]['row'][0])
+
+    def test_consistent_reads(self):
+        statement = Statement("MATCH (n) RETURN n", consistent=True)
+        self.assertEqual(["a", "a"], [self.connection.post(statement)[0]['data'][0]['row'][0] for _ in range(2)])
+
+        # Unlike a write, a read can be sent again if the leader hangs up
+        self.servers[0].behaviour = "hang up"
+        self.servers[0].leader = False
+        self.servers[2].leader = True
+        self.assertEqual("c", self.connection.post(statement)[0]['data'][0]['row'][0])
+
+    def test_replica_failover(self):
+        self.servers[1].shutdown()
+        self.servers[1].server_close()
+        self.assertEqual(["c", "c", "c"], [self.read() for _ in range(3)])
+
+    def test_leader_failover(self):
+        self.assertEqual("a", self.write())
+        self.servers[0].shutdown()
+        self.servers[0].server_close()
+        self.servers[2].leader = True
+        self.assertEqual("c", self.write())
+        self.assertEqual(["b", "b"], [self.read() for _ in range(2)])
+
+    def test_unavailable_replica(self):
+        self.servers[1].behaviour = "unavailable"
+        self.assertEqual(["c", "c"], [self.read() for _ in range(2)])
+
+    def test_write_not_resent(self):
+        self.assertEqual("a", self.write())
+        self.servers[0].behaviour = "hang up"
+        self.servers[0].leader = False
+        self.servers[2].leader = True
+        self.assertRaises(ConnectionError, self.write)
+        self.assertEqual([], self.servers[2].statements)
+
+    def test_slow_transactions(self):
+        self.servers[1].behaviour = "slow"
+        self.servers[2].behaviour = "slow"
+        self.assertEqual("b", self.read())
+
+        self.connection.transaction_timeout = 0.2
+        self.assertRaises(TimeoutError, self.read)
+        # Being slow doesn't make a member unreachable
+        self.connection.transaction_timeout = None
+        self.assertEqual(["b", "c"], [self.read() for _ in range(2)])
+
+    def test_no_members(self):
+        for server in self.servers:
+            server.leader = False
+        self.assertRaises(ConnectionError, self.write)
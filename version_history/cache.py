@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    def __init__(self, max_entries=4096, max_bytes=None):
+        """
+        A cache that holds a bounded number of values, discarding the least recently used when it is full.  Each
+        value may be given a size in bytes, so that the total size can be bounded too.  Thread safe.
+
+        :param int max_entries: The most values to hold.  Defaults to 4096
+        :param int max_bytes: The most bytes to hold, going by the sizes given when values are stored.  Values larger
+                              than this are never stored.  Defaults to no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        #: The values held, with their sizes, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Looks up a value, marking it as the most recently used
+
+        :param key: The key the value was stored under
+        :param default: What to return if the value isn't held
+        :return: The value, or ``default``
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """
+        Stores a value, discarding the least recently used values if the cache is full
+
+        :param key: The key to store the value under
+        :param value: The value
+        :param int size: The size of the value in bytes
+        """
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Discards a value, if it is held
+
+        :param key: The key the value was stored under
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """
+        Discards every value.  The statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that found their value, or 0 if there haven't been any
+
+        :rtype: float
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def statistics(self):
+        """
+        Describes how the cache has performed.  For example::
+
+            {"entries": 120, "bytes": 1048576, "hits": 950, "misses": 130, "evictions": 10, "hit_rate": 0.8796}
+
+        :rtype: dict[str, int | float]
+        """
+        hit_rate = self.hit_rate
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hit_rate,
+            }
@@ -0,0 +1,41 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def to_columns(result):
+    """
+    Converts the result of a statement from rows into columns.  Columns holding only integers, or only numbers, are
+    given as typed arrays: NumPy arrays when NumPy is installed, or :class:`array.array` otherwise.  Other columns,
+    including any with missing values, are given as lists.  For example, the result shown in
+    :meth:`version_history.connection.Connection.post` becomes::
+
+            {
+              "r": [{"friendly": True, "name": "Bob"}, {"name": "Alice"}],
+              "id(r)": array([15, 16])
+            }
+
+    :param dict result: The result of one statement, as returned by the database
+    :return: Each column of the result, keyed by name
+    :rtype: dict[str, list | numpy.ndarray | array.array]
+    """
+    rows = result['data']
+    return {name: _typed([row['row'][index] for row in rows]) for index, name in enumerate(result['columns'])}
+
+
+def _typed(values):
+    """
+    Packs a column of values into a typed array, if they all share a numeric type
+    """
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        type_code = 'q'
+    elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        type_code = 'd'
+    else:
+        return values
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int64 if type_code == 'q' else numpy.float64)
+    return array(type_code, values)
@@ -0,0 +1,86 @@
+from base64 import b64decode, b64encode
+from codecs import decode
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+#: Payloads shorter than this many bytes are not worth compressing, and are stored as they are
+DEFAULT_THRESHOLD = 1024
+
+
+def _zstd_compress(raw):
+    if zstandard is None:
+        raise ValueError("The zstd codec requires the zstandard package")
+    return zstandard.ZstdCompressor().compress(raw)
+
+
+def _zstd_decompress(raw):
+    if zstandard is None:
+        raise ValueError("The zstd codec requires the zstandard package")
+    return zstandard.ZstdDecompressor().decompress(raw)
+
+
+#: The compression functions for each codec, and their inverses
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "zstd": (_zstd_compress, _zstd_decompress),
+}
+
+
+def compress(text, codec="zlib", threshold=DEFAULT_THRESHOLD):
+    """
+    Compresses a payload if it is long enough to be worth it, and if compressing it actually makes it smaller.
+    Compressed payloads are base64 encoded, and the node holding one should be tagged with a ``codec`` property
+    naming the codec used.  Nodes without the tag hold their payload as it was given.
+
+    :param str text: The payload to compress
+    :param str codec: The name of the codec to use.  One of the keys of :data:`CODECS`
+    :param int threshold: The smallest payload, in bytes, that will be compressed
+    :return: The payload to store, and the codec used to compress it, or None if it was left as it was
+    :rtype: (str, str)
+    """
+    raw = text.encode("utf-8")
+    if codec is None or len(raw) < threshold:
+        return text, None
+    if codec not in CODECS:
+        raise ValueError("Unknown compression codec: {}".format(codec))
+    compressed = decode(b64encode(CODECS[codec][0](raw)), "ascii")
+    if len(compressed) >= len(raw):
+        return text, None
+    return compressed, codec
+
+
+def decompress(payload, codec):
+    """
+    Reverses :func:`compress`
+
+    :param str payload: The stored payload
+    :param str codec: The codec the payload was compressed with, or None if it wasn't
+    :return: The original payload
+    :rtype: str
+    """
+    if codec is None:
+        return payload
+    if codec not in CODECS:
+        raise ValueError("Unknown compression codec: {}".format(codec))
+    return CODECS[codec][1](b64decode(payload)).decode("utf-8")
+
+
+def decode_properties(properties, key):
+    """
+    Gives the properties of a node as they were before compression
+
+    :param dict[str, any] properties: The properties of the node, as stored in the database
+    :param str key: The name of the property holding the payload
+    :return: A copy of the properties with the payload decompressed, and the codec tag removed
+    :rtype: dict[str, any]
+    """
+    decoded = dict(properties)
+    codec = decoded.pop("codec", None)
+    if key in decoded:
+        decoded[key] = decompress(decoded[key], codec)
+    return decoded
@@ -1,12 +1,16 @@
 from base64 import b64encode
 from codecs import decode
+from hashlib import sha256
 import json
 from io import StringIO
+import os
+import re
 import requests
+from version_history.columnar import to_columns
 
 
 class Connection:
-    def __init__(self, username, password, host='localhost', port=7474, path='db/data'):
+    def __init__(self, username, password, host='localhost', port=7474, path='db/data', profiler=None):
         """
         Initializes a connection to the graph database.  No requests will be made until one of the methods are called
 
@@ -15,12 +19,15 @@ class Connection:
         :param str host: The hostname where the database is located.  Defaults to 'localhost'
         :param int port: The port the database is listening on. Defaults to 7474.
         :param str path: The path the database is located at. Used in case of multiple databases. Defaults to 'db/data'
+        :param profiler: If given, every statement is run under the profiler's mode, and its query plan recorded
+        :type profiler: :class:`version_history.profiling.Profiler`
         """
         self._path = path
         self._port = port
         self._host = host
         self._password = password
         self._username = username
+        self.profiler = profiler
 
         self._url = "http://{}:{}/{}/transaction/commit".format(host, port, path)
 
@@ -31,7 +38,7 @@ class Connection:
         :return: The result of the request
         :rtype: dict[str, dict]
         """
-        return self.post(Statement("MATCH (n) OPTIONAL MATCH (n)-[r]-() DELETE n,r"))[0]
+        return self.post(Statement("MATCH (n) OPTIONAL MATCH (n)-[r]-() DELETE n,r", operation="clear"))[0]
 
     def find(self, label=None, match_params=None):
         """
@@ -48,6 +55,38 @@ class Connection:
         :rtype: list[(int, dict)]
         """
         output = StringIO()
+        self._write_match(output, label, match_params)
+        output.write(" return r, id(r)")
+        statement = Statement(output.getvalue(), operation="find")
+        return [(row['row'][1], row['row'][0]) for row in self.post(statement)[0]['data']]
+
+    def find_columnar(self, label=None, match_params=None, properties=()):
+        """
+        Finds nodes matching the given criteria, like :meth:`find`, but returns the results as columns.  Only the
+        requested properties are fetched, so no node is sent whole.  The ids are given in the column "id", and each
+        property in a column of its own name.  See :func:`version_history.columnar.to_columns` for how each column
+        is typed.  For example::
+
+            {"id": array([15, 37]), "name": ["Bob", "Alice"]}
+
+        :param str label: A label that matching nodes must have (optional)
+        :param dict match_params: The properties that matching nodes must have
+        :param list[str] properties: The properties to fetch for each node
+        :return: The ids and properties of the matching nodes, keyed by column
+        :rtype: dict[str, list | numpy.ndarray | array.array]
+        """
+        output = StringIO()
+        self._write_match(output, label, match_params)
+        output.write(" return id(r) AS id")
+        for key in properties:
+            output.write(", r.`{0}` AS `{0}`".format(key))
+        return self.post_columnar(Statement(output.getvalue(), operation="find"))[0]
+
+    @staticmethod
+    def _write_match(output, label, match_params):
+        """
+        Writes a clause matching nodes, as ``r``, that have the given label and properties
+        """
         output.write("MATCH (r")
         if label:
             output.write(":")
@@ -70,9 +109,6 @@ class Connection:
                     output.write(str(value))
                 is_first = False
 
-        output.write(" return r, id(r)")
-        return [(row['row'][1], row['row'][0]) for row in self.post(Statement(output.getvalue()))[0]['data']]
-
     def post(self, *statements):
         """
         Sends statements to the database to be executed as a single transaction. The results are returned as delivered
@@ -108,33 +144,111 @@ class Connection:
         :return: The result of executing the statements on the database
         :rtype: list[dict[str, list[dict[str, any]]
         """
-        statement_body = StringIO()
-        statement_body.write('{"statements":[')
-        for index in range(len(statements) - 1):
-            statements[index].write_json(statement_body)
-            statement_body.write(",")
-        statements[len(statements) - 1].write_json(statement_body)
-        statement_body.write(']')
-        result = requests.post(self._url, statement_body.getvalue(), auth=(self._username, self._password)).json()
+        profiled = statements
+        if self.profiler is not None:
+            statements = tuple(self.profiler.prepare(statement) for statement in statements)
+        if any(statement.streams for statement in statements):
+            # Stream the body so that large content is never held in memory all at once
+            body = self._iter_body(statements)
+        else:
+            statement_body = StringIO()
+            statement_body.write('{"statements":[')
+            for index in range(len(statements) - 1):
+                statements[index].write_json(statement_body)
+                statement_body.write(",")
+            statements[len(statements) - 1].write_json(statement_body)
+            statement_body.write(']')
+            body = statement_body.getvalue()
+        result = self._send(statements, body)
         if len(result['errors']) > 0:
             print(result['errors'][0]['message'])
             raise ConnectionError(result['errors'][0]['message'])
+        if self.profiler is not None:
+            for statement, statement_result in zip(profiled, result['results']):
+                self.profiler.record(statement, statement_result)
         return result['results']
 
+    def post_columnar(self, *statements):
+        """
+        Sends statements to the database to be executed as a single transaction, like :meth:`post`, but returns the
+        result of each statement as columns.  See :func:`version_history.columnar.to_columns`.
+
+        :param statements: The statements to be executed on the database
+        :type statements: list[:class:`Statement`]
+        :return: The columns of each statement's result, keyed by name
+        :rtype: list[dict[str, list | numpy.ndarray | array.array]]
+        """
+        return [to_columns(result) for result in self.post(*statements)]
+
+    def _send(self, statements, body):
+        """
+        Sends the body of a request to the database
+
+        :param statements: The statements that make up the body
+        :type statements: list[:class:`Statement`]
+        :param body: The body, either as text or as a generator from :meth:`_iter_body`
+        :return: The decoded response
+        :rtype: dict
+        """
+        return requests.post(self._url, body, auth=(self._username, self._password)).json()
+
+    @staticmethod
+    def _iter_body(statements, buffer_size=65536):
+        """
+        Generates the body of a request in pieces, as utf-8 encoded bytes no bigger than roughly ``buffer_size``
+
+        :param statements: The statements that make up the body
+        :type statements: list[:class:`Statement`]
+        :param int buffer_size: How many characters to gather before handing them off
+        """
+        def chunks():
+            yield '{"statements":['
+            for index, statement in enumerate(statements):
+                if index:
+                    yield ","
+                yield from statement.iter_json()
+            yield ']'
+
+        buffer = []
+        buffered = 0
+        for chunk in chunks():
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= buffer_size:
+                yield "".join(buffer).encode("utf-8")
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+
 
 class Statement:
-    __slots__ = ['statement', 'parameters']
+    __slots__ = ['statement', 'parameters', 'streams', 'operation', 'consistent']
 
-    def __init__(self, statement, parameters=None):
+    #: Matches the placeholders that mark where streamed content belongs within the parameters
+    _STREAM_PLACEHOLDER = re.compile(r'@@stream:[^@]+@@')
+
+    def __init__(self, statement, parameters=None, streams=None, operation=None, consistent=False):
         """
         Generates a statement that can be executed on the server.  Lightweight class.
 
         :param str statement: The statement to be executed
         :param dict[str, any] parameters: An array of parameters to be transmitted along with the statement.
                                           Each parameter should be referenced in the statement by its key
+        :param streams: Content to be streamed into the parameters as base64 text.  Each key is a placeholder
+                        of the form ``@@stream:<name>@@`` that appears somewhere within a string parameter
+        :type streams: dict[str, :class:`StreamedContent`]
+        :param str operation: What the statement does, such as "create" or "advance branch".  Used to group statements
+                              when profiling
+        :param bool consistent: Whether the statement must see every transaction committed so far.  A single database
+                                always does, but in a cluster only the leader is sure to, so
+                                :class:`version_history.routing.RoutingConnection` sends these statements there
         """
         self.statement = statement
         self.parameters = parameters
+        self.streams = streams
+        self.operation = operation
+        self.consistent = consistent
 
     def write_json(self, writer):
         """
@@ -142,39 +256,100 @@ class Statement:
 
         :param writer: A file like object
         """
-        def write_dict(d):
-            writer.write('{')
-            first = True
-            for k, v in d.items():
-                if first:
-                    first = False
-                else:
-                    writer.write(",")
-                writer.write("\\\"")
-                writer.write(k)
-                writer.write("\\\":")
-                if v is None:
-                    writer.write("null")
-                elif isinstance(v, str):
-                    writer.write("\\\"")
-                    writer.write(v)
-                    writer.write("\\\"")
-                elif isinstance(v, bool) or isinstance(v, int):
-                    writer.write(v)
-                elif isinstance(v, bytes) or isinstance(v, bytearray):
-                    writer.write("\\\"")
-                    writer.write(decode(b64encode(v), "ascii"))
-                    writer.write("\\\"")
-                elif isinstance(v, dict):
-                    write_dict(v)
-            writer.write('}')
-        writer.write('{"statement":"')
-        writer.write(self.statement.replace('"', '\\"').replace("\n", "\\n"))
-        writer.write('"')
+        for chunk in self.iter_json():
+            writer.write(chunk)
+
+    def iter_json(self):
+        """
+        Generates the compact json representation of the statement in pieces.  Streamed content is read as it
+        is generated, so it is never held in memory all at once.
+        """
+        yield '{"statement":"'
+        yield self.statement.replace('"', '\\"').replace("\n", "\\n")
+        yield '"'
         if self.parameters:
-            writer.write(',"parameters":')
-            writer.write(json.dumps(self.parameters, separators=(',', ':'), sort_keys=True))
-        writer.write('}')
+            yield ',"parameters":'
+            if self.streams:
+                # Encoding in pieces uses the pure Python encoder, which is much slower, so only streams pay for it
+                encoder = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+                for chunk in encoder.iterencode(self.parameters):
+                    yield from self._substitute_streams(chunk)
+            else:
+                yield json.dumps(self.parameters, separators=(',', ':'), sort_keys=True)
+        yield '}'
 
+    def _substitute_streams(self, chunk):
+        """
+        Replaces the stream placeholders within a piece of json with the content they stand for
+        """
+        position = 0
+        for match in self._STREAM_PLACEHOLDER.finditer(chunk):
+            yield chunk[position:match.start()]
+            yield from self.streams[match.group()].iter_base64()
+            position = match.end()
+        yield chunk[position:]
 
 
+class StreamedContent:
+    def __init__(self, source, chunk_size=3 * 1024 * 1024):
+        """
+        Content that is read from a file a piece at a time, rather than held in memory.  The content can be
+        read more than once, so a file object must be seekable.
+
+        :param source: A path to the file, or a binary file object positioned at the start of the content
+        :type source: str | os.PathLike | io.BufferedIOBase
+        :param int chunk_size: How many bytes to read at a time.  Rounded down to a multiple of 3, so that each chunk
+                               encodes to base64 without padding.  Defaults to 3 MiB
+        """
+        self.source = source
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self._start = None if isinstance(source, (str, os.PathLike)) else source.tell()
+
+    def iter_chunks(self):
+        """
+        Generates the raw content in chunks of :attr:`chunk_size` bytes (the last one may be shorter)
+
+        :rtype: collections.Iterable[bytes]
+        """
+        if self._start is None:
+            with open(self.source, "rb") as reader:
+                yield from self._read_chunks(reader)
+        else:
+            self.source.seek(self._start)
+            yield from self._read_chunks(self.source)
+
+    def _read_chunks(self, reader):
+        leftover = b""
+        while True:
+            block = reader.read(self.chunk_size - len(leftover))
+            if not block:
+                break
+            leftover += block
+            if len(leftover) == self.chunk_size:
+                yield leftover
+                leftover = b""
+        if leftover:
+            yield leftover
+
+    def iter_base64(self):
+        """
+        Generates the content as base64 text, a chunk at a time
+
+        :rtype: collections.Iterable[str]
+        """
+        for chunk in self.iter_chunks():
+            yield decode(b64encode(chunk), "ascii")
+
+    def sha256(self):
+        """
+        Reads through the content, and computes its hash
+
+        :return: The hex digest of the SHA-256 hash of the content, and its length in bytes
+        :rtype: (str, int)
+        """
+        digest = sha256()
+        size = 0
+        for chunk in self.iter_chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
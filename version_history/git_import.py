@@ -0,0 +1,363 @@
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+import posixpath
+import subprocess
+from uuid import uuid4
+
+
+class GitImporter:
+    def __init__(self, history, repository, batch_size=100, workers=None, branch="head"):
+        """
+        Imports the history of a local git repository as revisions.  Each commit on the first parent line of the
+        imported ref becomes one revision, annotated with the commit message.  Added files are created with their
+        content, removed files are deleted, and changed files are modified with insert and remove operations computed
+        from a line diff.  Directories are created as they are first needed, so the files form the same hierarchy, and
+        are deleted along with the last file within them.
+
+        Commits are read with ``git fast-export``, and file content with ``git cat-file``.  The diffs for a batch of
+        commits are computed in parallel, across several processes, and the batch is then committed in a single
+        transaction.  Each revision is committed with a commit key, so that later revisions in the same transaction
+        can refer to the files it creates before their ids are known.  See
+        :meth:`version_history.history.PreparedRevision.entity`.
+
+        Changes to binary files can't be described as operations on text, so a changed binary file is deleted and
+        created again.  Submodules are skipped.
+
+        :param history: The repository to import into
+        :type history: :class:`version_history.history.History`
+        :param str repository: The path to the git repository
+        :param int batch_size: The most commits to diff and send in one transaction.  Defaults to 100
+        :param int workers: How many processes to compute diffs with.  Defaults to the number of processors
+        :param str branch: The name of the branch that the revisions are added to.  Defaults to "head"
+        """
+        self.history = history
+        self.repository = repository
+        self.batch_size = batch_size
+        self.workers = workers
+        self.branch = branch
+
+        #: The blob each imported path currently holds
+        self._blobs = {}
+        #: The entity for each imported path, both files and directories, either as an id or, if not yet sent, as the
+        #: position of its revision in the current batch and its temporary id
+        self._entities = {}
+        #: How many imported files each directory holds, at any depth
+        self._file_counts = {}
+        #: Distinguishes the commit keys of this import from those of any other
+        self._import_id = uuid4().hex
+        #: The revisions staged but not yet sent: the prepared revision, its git commit id and the paths it created
+        self._batch = []
+        #: The id of each imported revision, keyed by git commit id
+        self._imported = {}
+
+    def run(self, ref="HEAD"):
+        """
+        Imports the commits reachable from a ref, following first parents only.  Commits are imported oldest first.
+
+        :param str ref: The ref to import.  Defaults to "HEAD"
+        :return: The id of the revision each commit became, keyed by git commit id
+        :rtype: dict[str, int]
+        :raises subprocess.CalledProcessError: If git fails, such as when the ref or the repository doesn't exist.
+                                              The batches sent before the failure remain imported
+        """
+        export = subprocess.Popen(["git", "fast-export", "--no-data", "--show-original-ids", "--reencode=yes",
+                                   "--first-parent", ref], cwd=self.repository, stdout=subprocess.PIPE)
+        blobs = _BlobReader(self.repository)
+        try:
+            with ProcessPoolExecutor(self.workers, initializer=_start_worker, initargs=(self.repository,)) as pool:
+                commits = []
+                for commit in _read_commits(export.stdout):
+                    commits.append(commit)
+                    if len(commits) >= self.batch_size:
+                        self._import(commits, pool, blobs)
+                        commits = []
+                if commits:
+                    self._import(commits, pool, blobs)
+            # An export that stops early looks just like a shorter history, so its exit status is the only sign
+            if export.wait() != 0:
+                raise subprocess.CalledProcessError(export.returncode, export.args)
+            self._flush()
+        finally:
+            export.stdout.close()
+            export.wait()
+            blob_status = blobs.close()
+        if blob_status != 0:
+            raise subprocess.CalledProcessError(blob_status, blobs.args)
+        return dict(self._imported)
+
+    def _import(self, commits, pool, blobs):
+        """
+        Stages a batch of commits, computing their diffs in parallel first
+        """
+        pairs = []
+        blob_state = dict(self._blobs)
+        for commit in commits:
+            for change in commit.changes:
+                if change[0] == "M" and change[1] in blob_state:
+                    pairs.append((blob_state[change[1]], change[2]))
+                _apply_change(blob_state, change)
+        diffs = dict(zip(pairs, pool.map(_diff_blobs, pairs, chunksize=16)))
+        for commit in commits:
+            self._stage(commit, diffs, blobs)
+
+    def _stage(self, commit, diffs, blobs):
+        """
+        Records a commit's changes in the history, and sets aside the statements that will commit them
+        """
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        created = []
+        revision_index = len(self._batch)
+        emptied = set()
+
+        def entity(path):
+            current = self._entities[path]
+            if not isinstance(current, tuple):
+                return current
+            if current[0] == revision_index:
+                return current[1]
+            # Created by an earlier revision in this transaction
+            return self._batch[current[0]][0].entity(current[1])
+
+        def create(path, **data):
+            parent = posixpath.dirname(path)
+            if parent and parent not in self._entities:
+                create(parent, type='directory')
+            temp_id = self.history.create_file(entity(parent) if parent else None,
+                                               filename=posixpath.basename(path), **data)
+            self._entities[path] = (revision_index, temp_id)
+            created.append(path)
+
+        def count_file(path, change):
+            directory = posixpath.dirname(path)
+            while directory:
+                self._file_counts[directory] = self._file_counts.get(directory, 0) + change
+                if not self._file_counts[directory]:
+                    emptied.add(directory)
+                directory = posixpath.dirname(directory)
+
+        for change in commit.changes:
+            if change[0] == "M":
+                path, blob = change[1], change[2]
+                if path in self._blobs:
+                    operations = diffs[(self._blobs[path], blob)]
+                    if operations is None:
+                        self.history.delete_file(entity(path))
+                        create(path, content=blobs.read(blob), type='file')
+                    elif operations:
+                        self.history.modify_file(entity(path), *operations)
+                else:
+                    create(path, content=blobs.read(blob), type='file')
+                    count_file(path, 1)
+            else:
+                for path in _deleted_paths(self._blobs, change):
+                    self.history.delete_file(entity(path))
+                    del self._entities[path]
+                    count_file(path, -1)
+            _apply_change(self._blobs, change)
+        # Directories are deleted once the commit's changes are all in, as it may add files to them again
+        for directory in sorted(emptied, key=len, reverse=True):
+            if not self._file_counts[directory]:
+                self.history.delete_file(entity(directory))
+                del self._entities[directory]
+                del self._file_counts[directory]
+        self.history.annotate(commit.message)
+        self._batch.append((self.history.prepare_revision(self.branch,
+                                                          "git:{}:{}".format(self._import_id, commit.commit_id)),
+                            commit.commit_id, created))
+
+    def _flush(self):
+        """
+        Sends the staged revisions to the database in a single transaction
+        """
+        if not self._batch:
+            return
+        results = self.history.commit_prepared([revision for revision, _, _ in self._batch])
+        for revision_index, ((_, commit_id, created), (revision, mapping)) in enumerate(zip(self._batch, results)):
+            self._imported[commit_id] = revision
+            for path in created:
+                current = self._entities.get(path)
+                if isinstance(current, tuple) and current[0] == revision_index:
+                    self._entities[path] = mapping[current[1]]
+        self._batch = []
+
+
+class _Commit:
+    __slots__ = ['commit_id', 'message', 'changes']
+
+    def __init__(self, commit_id, message, changes):
+        """
+        A commit read from ``git fast-export``
+
+        :param str commit_id: The git commit id
+        :param str message: The commit message
+        :param list[tuple] changes: The file changes: ("M", path, blob) for an added or changed file, ("D", path) for
+                                    a removed file or directory, and ("deleteall",) when everything is removed
+        """
+        self.commit_id = commit_id
+        self.message = message
+        self.changes = changes
+
+
+def _read_commits(stream):
+    """
+    Parses the output of ``git fast-export --no-data --show-original-ids``
+
+    :param stream: The binary output of the export
+    :rtype: collections.Iterable[_Commit]
+    """
+    commit = None
+    for line in iter(stream.readline, b""):
+        line = line.rstrip(b"\n")
+        if line.startswith(b"commit "):
+            commit = _Commit(None, "", [])
+        elif commit is None:
+            continue
+        elif line.startswith(b"original-oid "):
+            commit.commit_id = line[13:].decode("ascii")
+        elif line.startswith(b"data "):
+            commit.message = stream.read(int(line[5:])).decode("utf-8", "replace")
+        elif line.startswith(b"M "):
+            mode, blob, path = line[2:].split(b" ", 2)
+            # Submodules have no content of their own
+            if mode != b"160000":
+                commit.changes.append(("M", _unquote(path), blob.decode("ascii")))
+        elif line.startswith(b"D "):
+            commit.changes.append(("D", _unquote(line[2:])))
+        elif line == b"deleteall":
+            commit.changes.append(("deleteall",))
+        elif line == b"":
+            yield commit
+            commit = None
+    if commit is not None:
+        yield commit
+
+
+def _unquote(path):
+    """
+    Decodes a path from ``git fast-export``, which quotes paths containing unusual characters in the style of C
+    """
+    if not path.startswith(b'"'):
+        return path.decode("utf-8")
+    return path[1:-1].decode("unicode_escape").encode("latin-1").decode("utf-8")
+
+
+def _deleted_paths(blobs, change):
+    """
+    The files removed by a change, given the blob each path currently holds
+    """
+    if change[0] == "deleteall":
+        return list(blobs)
+    if change[0] == "D":
+        prefix = change[1] + "/"
+        return [path for path in blobs if path == change[1] or path.startswith(prefix)]
+    return []
+
+
+def _apply_change(blobs, change):
+    """
+    Updates the blob each path holds to reflect a change
+    """
+    if change[0] == "M":
+        blobs[change[1]] = change[2]
+    else:
+        for path in _deleted_paths(blobs, change):
+            del blobs[path]
+
+
+def _operations(old, new):
+    """
+    Computes the operations that turn one version of a text file into another, from a line diff.  Each operation's
+    location is in characters, within the text as it stands after the operations before it.
+
+    :param bytes old: The old content
+    :param bytes new: The new content
+    :return: The operations, or None if either version isn't text
+    :rtype: list[dict[str, any]]
+    """
+    try:
+        old_lines = old.decode("utf-8").splitlines(True)
+        new_lines = new.decode("utf-8").splitlines(True)
+    except UnicodeDecodeError:
+        return None
+    old_offsets = [0]
+    for line in old_lines:
+        old_offsets.append(old_offsets[-1] + len(line))
+    operations = []
+    shift = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        location = old_offsets[i1] + shift
+        removed = old_offsets[i2] - old_offsets[i1]
+        if removed:
+            operations.append({'type': 'remove', 'length': removed, 'location': location})
+        inserted = "".join(new_lines[j1:j2])
+        if inserted:
+            operations.append({'type': 'insert', 'content': inserted, 'location': location})
+        shift += len(inserted) - removed
+    return operations
+
+
+class _BlobReader:
+    def __init__(self, repository):
+        """
+        Reads blobs from a git repository through a long running ``git cat-file --batch``
+
+        :param str repository: The path to the git repository
+        """
+        self._process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=repository,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, blob):
+        """
+        :param str blob: The id of the blob
+        :return: The content of the blob
+        :rtype: bytes
+        """
+        self._process.stdin.write(blob.encode("ascii") + b"\n")
+        self._process.stdin.flush()
+        header = self._process.stdout.readline().split()
+        if not header:
+            # The process has exited, and says why on stderr
+            raise subprocess.CalledProcessError(self._process.wait(), self._process.args)
+        if len(header) < 3 or header[1] != b"blob":
+            raise ValueError("{} is not a blob".format(blob))
+        content = self._process.stdout.read(int(header[2]))
+        self._process.stdout.read(1)
+        return content
+
+    @property
+    def args(self):
+        """
+        The command the blobs are read with
+        """
+        return self._process.args
+
+    def close(self):
+        """
+        Stops reading blobs
+
+        :return: The exit status of ``git cat-file``
+        :rtype: int
+        """
+        self._process.stdin.close()
+        self._process.wait()
+        self._process.stdout.close()
+        return self._process.returncode
+
+
+#: The blob reader of a diffing process
+_worker_blobs = None
+
+
+def _start_worker(repository):
+    global _worker_blobs
+    _worker_blobs = _BlobReader(repository)
+
+
+def _diff_blobs(pair):
+    """
+    Computes the operations between two blobs, in a diffing process
+    """
+    return _operations(_worker_blobs.read(pair[0]), _worker_blobs.read(pair[1]))
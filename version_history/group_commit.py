@@ -0,0 +1,107 @@
+from threading import Condition
+import time
+
+
+class GroupCommitter:
+    def __init__(self, connection, window=0.01, max_revisions=32):
+        """
+        Coalesces the revisions of several producers into a single transaction.  Each producer keeps its own
+        :class:`version_history.history.History`, and calls :meth:`commit` instead of
+        :meth:`version_history.history.History.commit`.  Revisions arriving within ``window`` seconds of each other,
+        up to ``max_revisions`` of them, are sent to the database with one request.
+
+        Unlike the rest of this package, this class is thread safe; that is its purpose.
+
+        :param connection: The connection that the grouped transactions will be sent through
+        :type connection: :class:`version_history.connection.Connection`
+        :param float window: How long, in seconds, to wait for other revisions before sending a group.
+                             Defaults to 10 milliseconds
+        :param int max_revisions: The largest number of revisions to send in one transaction.  A group is sent as
+                                  soon as it reaches this size.  Defaults to 32
+        """
+        self.connection = connection
+        self.window = window
+        self.max_revisions = max_revisions
+
+        self._condition = Condition()
+        #: The revisions waiting to be sent, in the order they were submitted
+        self._pending = []
+        #: Whether a producer is currently gathering or sending a group
+        self._flushing = False
+
+    def commit(self, history, branch="head"):
+        """
+        Commit all commands that have been created so far in ``history`` to the tip of ``branch``.  Blocks until the
+        group containing this revision has been committed.  Revisions within a group are applied in the order they
+        were submitted, each one on top of the last.  The commands are taken from ``history`` as soon as this is
+        called, so if the commit fails they must be created again.
+
+        :param history: The repository whose pending commands should be committed
+        :type history: :class:`version_history.history.History`
+        :param str branch: The name of the branch that the revision should be added to.  Defaults to "head"
+        :return: The id of the revision just committed and
+                 a dictionary of temporary ids to their actual id for access in the application
+        :rtype: (int, dict[str, int])
+        """
+        entry = _GroupEntry(history.prepare_revision(branch))
+        with self._condition:
+            self._pending.append(entry)
+            self._condition.notify_all()
+            while not entry.done:
+                if self._flushing:
+                    self._condition.wait()
+                    continue
+                # Nobody is gathering a group, so this producer does it
+                self._flushing = True
+                deadline = time.monotonic() + self.window
+                remaining = self.window
+                while len(self._pending) < self.max_revisions and remaining > 0:
+                    self._condition.wait(remaining)
+                    remaining = deadline - time.monotonic()
+                group = self._pending[:self.max_revisions]
+                self._pending = self._pending[self.max_revisions:]
+                self._condition.release()
+                try:
+                    self._send(group)
+                finally:
+                    self._condition.acquire()
+                    for sent in group:
+                        sent.done = True
+                    self._flushing = False
+                    self._condition.notify_all()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def _send(self, group):
+        """
+        Sends a group of revisions as a single transaction, and hands each one its own results
+
+        :param list[_GroupEntry] group: The revisions to send
+        """
+        try:
+            results = group[0].revision.history.commit_prepared([entry.revision for entry in group], self.connection)
+            for entry, result in zip(group, results):
+                entry.result = result
+        except Exception as error:
+            # Every producer waiting on this group must hear of the failure, not just the one sending it
+            for entry in group:
+                if entry.result is None:
+                    entry.error = error
+
+
+class _GroupEntry:
+    __slots__ = ['revision', 'result', 'error', 'done']
+
+    def __init__(self, revision):
+        """
+        A single producer's revision, waiting to be committed as part of a group
+
+        :param revision: The revision to commit
+        :type revision: :class:`version_history.history.PreparedRevision`
+        """
+        self.revision = revision
+        self.result = None
+        self.error = None
+        self.done = False
@@ -1,67 +1,243 @@
-from base64 import b64encode
+from base64 import b64decode, b64encode
 from codecs import decode
+from collections import Counter
+from hashlib import sha256
 import json
-from version_history.connection import Statement
+import logging
+import os
+import re
+from version_history import compression
+from version_history.connection import Statement, StreamedContent
+
+
+#: The version of the layout used to store repositories in the database
+SCHEMA_VERSION = 4
+
+#: The indexes and constraints added by each version of the schema
+SCHEMA_INDEXES = {
+    2: ["CREATE CONSTRAINT ON (t:TERM) ASSERT t.text IS UNIQUE"],
+    3: ["CREATE INDEX ON :FILE_ENTITY(path)"],
+    4: ["CREATE CONSTRAINT ON (r:REVISION) ASSERT r.commit_key IS UNIQUE"],
+}
+
+_logger = logging.getLogger(__name__)
+
+#: Matches the words that are added to the search index
+_WORD = re.compile(r"\w\w+")
 
 
 class History:
-    def __init__(self, connection):
+    def __init__(self, connection, compression_codec="zlib", compression_threshold=compression.DEFAULT_THRESHOLD,
+                 cache=None):
         """
         Set up versioning for a file tree.  This class is not thread safe, nor is it designed for concurrent
         access.  The database behind it, however, is.
 
+        Only the repository's metadata is read when the history is created: the branches, the revision each one is
+        at, and the schema version.  These are cached, and the cache is kept up to date as revisions are committed.
+
+        Command data and inserted content are compressed before being stored, when they are large enough to benefit.
+        Compressed payloads are decompressed by the methods that read them back.
+
         :param connection: The connection to the database that this repository will use
         :type connection: :class:`version_history.connection.Connection`
+        :param str compression_codec: The codec used to compress payloads; "zlib", "zstd" (requires the zstandard
+                                      package), or None to store them uncompressed.  Defaults to "zlib"
+        :param int compression_threshold: The smallest payload, in bytes, that will be compressed
+        :param cache: If given, committed history read through this repository is kept in the cache, so that reading
+                      it again doesn't need the database.  Committed history never changes, so nothing in the cache
+                      goes stale; only the branches move.  The latest command applied to each file is cached too,
+                      along with the revision the head branch was at, and is discarded when the head branch moves
+        :type cache: :class:`version_history.cache.LRUCache`
         """
         self.connection = connection
-        # Find the root file entity
-        result = self.connection.find("REVISION")
-        # If there isn't one, then initialize the repository
+        self.compression_codec = compression_codec
+        self.compression_threshold = compression_threshold
+        self.cache = cache
 
-        if len(result) < 1:
+        #: The names of the branches in the repository, and the id of the revision each one is currently at
+        self.branches = {}
+        #: The version of the layout of the repository in the database.  None for repositories created before
+        #: the version was recorded
+        self.schema_version = None
+
+        self._handshake()
+        # If there isn't a branch, then initialize the repository
+        if not self.branches:
             self._intitialze_repo()
+        if (self.schema_version or 0) < SCHEMA_VERSION:
+            self._upgrade_schema()
 
         #: The statements that will update the database to reflect the commands so far this revision
         self._statements = []
         #: The parameters associated with the statements for this revision
         self._parameters = {}
+        #: Content to be streamed into the parameters when the revision is sent, keyed by placeholder
+        self._streams = {}
         self._max_id = 1
 
         #: The ids that need to be looked up for reference within statements
         self._lookup_ids = set()
+        #: The words to add to the search index for this revision, and how many times each appears
+        self._terms = Counter()
+        #: The paths of the committed directories that files have been created within.  Paths never change
+        self._paths = {}
+        #: The file entities whose latest command this history has cached, to be discarded when the head branch moves
+        self._latest = set()
+
+    @property
+    def head(self):
+        """
+        The id of the revision that the "head" branch was at when last seen by this history
+
+        :rtype: int
+        """
+        return self.branches.get("head")
+
+    def refresh(self):
+        """
+        Reads the branches and schema version from the database again, picking up revisions committed elsewhere
+        """
+        head = self.head
+        self._handshake()
+        if self.head != head:
+            self._forget_latest()
+
+    def _handshake(self):
+        """
+        Reads the repository's metadata from the database in a single query, and caches it.
+        """
+        rows = self.connection.post(Statement("OPTIONAL MATCH (repo:REPOSITORY) "
+                                              "OPTIONAL MATCH (branch:BRANCH) <-[:AT]- (revision:REVISION) "
+                                              "RETURN repo.schema_version, branch.name, id(revision)",
+                                              operation="handshake", consistent=True))[0]['data']
+        self.branches = {}
+        for row in rows:
+            schema_version, branch, revision = row['row']
+            self.schema_version = schema_version
+            if branch is not None:
+                self.branches[branch] = revision
 
     def _intitialze_repo(self):
         """
-        Create the repository in the database.  Creates a starting revision and root file entity and data.
+        Create the repository in the database.  Creates a starting revision and the head branch.
+        """
+        result = self.connection.post(Statement('CREATE (b:BRANCH {name:"head"}) <-[:AT]- (r:REVISION) RETURN id(r)',
+                                                operation="initialize"))
+        self.branches = {"head": result[0]['data'][0]['row'][0]}
+
+    def _upgrade_schema(self):
+        """
+        Brings the layout of the repository up to the current :data:`SCHEMA_VERSION`, creating any indexes and
+        constraints that are missing, and records the new version.
         """
-        self.connection.post(Statement('CREATE (b:BRANCH {name:"head"}) <-[:AT]- (r:REVISION)'))
+        for version in sorted(SCHEMA_INDEXES):
+            if version > (self.schema_version or 0):
+                # Schema changes can't share a transaction with anything else
+                for index in SCHEMA_INDEXES[version]:
+                    self.connection.post(Statement(index, operation="schema"))
+        self.connection.post(Statement("MERGE (repo:REPOSITORY) SET repo.schema_version = {schema_version}",
+                                       {"schema_version": SCHEMA_VERSION}, operation="initialize"))
+        self.schema_version = SCHEMA_VERSION
 
-    def create_file(self, **data):
+    def create_file(self, parent=None, /, **data):
         """
         Creates a new file creation command in the repository.  The file won't be created until the :meth:`commit`
         method is called.
 
+        If the data includes a filename, the file entity is given a path: the path of its parent followed by
+        ``/<filename>``, or just ``/<filename>`` for files at the root.  Paths are indexed, so that everything within
+        a directory can be found quickly with :meth:`subtree`.  Each file entity is also CONTAINED by its parent.  The
+        path of a committed parent is read from the database the first time a file is created within it.
+
+        Top level values may be given as binary file objects or paths (:class:`os.PathLike`, not :class:`str`)
+        instead of :class:`bytes`.  These are stored exactly as bytes would be, but are read, hashed and sent to the
+        database a chunk at a time, so that files of any size can be stored without holding them in memory.  The
+        SHA-256 hash and size of each are recorded on the command as ``sha256_<key>`` and ``size_<key>``.  File
+        objects must be seekable, and must not be closed until the revision is committed.
+
+        The text values at the top level of the data, such as the filename and type, are added to the search index.
+
+        .. versionchanged:: schema version 3
+           The directory containing the file is given as ``parent``.  It can only be given by position, so data may
+           still include a key named ``parent``, which is stored like any other.
+
+        :param parent: The id of the directory containing this file, either as returned by this method earlier in
+                       this revision or as committed.  Defaults to the root
+        :type parent: str | int
         :param dict[str, any] data: The data associated with this file entity.  This includes filename, file type,
-                                    parent folders, and anything else required.  This structure is up to the user
-                                    of this class, this class only worries about storing the data
+                                    and anything else required.  This structure is up to the user of this class, this
+                                    class only worries about storing the data
         :return: The temporary id of this file
         :rtype: str
+        :raises ValueError: If the file has a filename but its parent has no path, because the parent was created
+                            without a filename, or before paths were recorded
         """
         def encode_bytes(b):
+            if isinstance(b, StreamedContent):
+                placeholder = "@@stream:{}:{}@@".format(new_id, len(self._streams))
+                self._streams[placeholder] = b
+                return placeholder
             return decode(b64encode(b), "ascii")
+        # Found first, so that nothing is recorded if the parent has no path
+        entity = {}
+        if isinstance(data.get("filename"), str):
+            entity["name"] = data["filename"]
+            entity["path"] = (self._path_of(parent) if parent is not None else "") + "/" + data["filename"]
         new_id = "temp_" + str(self._max_id)
         self._max_id += 1
         statement = "CREATE (revision) <-[:OCCURRED]- (c_{0}:COMMAND {{command_{0}}}) " \
                     "-[:APPLIED_TO]-> (e_{0}:FILE_ENTITY {{entity_{0}}})".format(new_id)
+        if parent is not None:
+            statement += " -[:CONTAINED]-> (e_{})".format(parent)
+            if not str(parent).startswith("temp_"):
+                self._lookup_ids.add(parent)
         self._statements.append(statement)
-        self._parameters["command_" + new_id] = {
+        command = {
             "type": "create",
-            "data": json.dumps(data, separators=(",", ":"), sort_keys=True, default=encode_bytes),
-        }
-        self._parameters["entity_" + new_id] = {
         }
+        streamed = False
+        for key, value in data.items():
+            if isinstance(value, str):
+                self._index_text(value)
+            if isinstance(value, os.PathLike) or hasattr(value, "read"):
+                data[key] = StreamedContent(value)
+                command["sha256_" + key], command["size_" + key] = data[key].sha256()
+                streamed = True
+        command["data"] = json.dumps(data, separators=(",", ":"), sort_keys=True, default=encode_bytes)
+        # Streamed content is never held in memory, so it can't be compressed ahead of time
+        if not streamed:
+            self._compress(command, "data")
+        self._parameters["command_" + new_id] = command
+        self._parameters["entity_" + new_id] = entity
         return new_id
 
+    def _path_of(self, entity_id):
+        """
+        Finds the path of a directory that a file is being created within
+
+        :param entity_id: The id of the directory's file entity, either temporary, committed or a reference
+        :type entity_id: str | int | EntityReference
+        :return: The directory's path
+        :rtype: str
+        """
+        if isinstance(entity_id, EntityReference):
+            path = entity_id.path
+        elif str(entity_id).startswith("temp_"):
+            path = self._parameters["entity_" + entity_id].get("path")
+        else:
+            path = self._paths.get(entity_id)
+            if path is None:
+                rows = self.connection.post(Statement("MATCH (e) WHERE id(e) = {} RETURN e.path".format(entity_id),
+                                                      operation="read", consistent=True))[0]['data']
+                path = rows[0]['row'][0] if rows else None
+                if path is not None:
+                    self._paths[entity_id] = path
+        if path is None:
+            raise ValueError("File entity {} has no path, so files can't be given paths within it.  It was created "
+                             "without a filename, or before paths were recorded".format(entity_id))
+        return path
+
     def delete_file(self, file_id):
         statement = "CREATE (revision) <-[:OCCURRED]- (c_{0}:COMMAND {{command_{0}}}) " \
                     "-[:APPLIED_TO]-> (e_{0}) ".format(file_id)
@@ -79,40 +255,511 @@ class History:
             'type': "modify",
         }
         for operation_index in range(len(operations)):
-            self._parameters['op_' + str(file_id) + '_' + str(operation_index)] = operations[operation_index]
+            operation = dict(operations[operation_index])
+            if isinstance(operation.get('content'), str):
+                self._compress(operation, 'content')
+            self._parameters['op_' + str(file_id) + '_' + str(operation_index)] = operation
 
         self._statements.append(statement + " -[:NEXT_OP]-> ".join(operation_statements))
         self._lookup_ids.add(file_id)
 
-    def commit(self, parent_revision):
+    def annotate(self, text):
+        """
+        Describes what was done in this revision, and why.  The annotation is stored on the revision the commands
+        occur in when :meth:`commit` is called, and is added to the search index.  Annotating again replaces the
+        previous annotation, though its words remain in the index.
+
+        :param str text: The annotation
+        """
+        if "SET revision.annotation = {annotation}" not in self._statements:
+            self._statements.append("SET revision.annotation = {annotation}")
+        self._parameters["annotation"] = text
+        self._index_text(text)
+
+    def _index_text(self, text):
+        """
+        Adds the words in some text to those that will be indexed for this revision
+        """
+        self._terms.update(_WORD.findall(text.lower()))
+
+    def search(self, query, skip=0, limit=10):
+        """
+        Finds the revisions whose annotations or file data match a query.  Revisions matching more of the words in the
+        query rank first; after that, revisions where the words are more frequent, and the words themselves are rarer,
+        rank higher.  The results are returned as an array of tuples, with each tuple consisting of the id of the
+        revision, its score and its annotation.  For example::
+
+            [(12, 1.5, "Removed outliers from the second trial"),
+             (9, 0.25, None)]
+
+        :param str query: The words to search for
+        :param int skip: The number of hits to skip over, for paging through results
+        :param int limit: The largest number of hits to return
+        :return: The matching revisions, best first
+        :rtype: list[(int, float, str)]
+        """
+        terms = sorted(set(_WORD.findall(query.lower())))
+        if not terms:
+            return []
+        results = self.connection.post(Statement("UNWIND {terms} AS term "
+                                                 "MATCH (t:TERM {text: term}) -[i:INDEXES]-> (r:REVISION) "
+                                                 "WITH r, count(t) AS matched, "
+                                                 "sum(toFloat(i.count) / t.revisions) AS score "
+                                                 "RETURN id(r), score, r.annotation "
+                                                 "ORDER BY matched DESC, score DESC, id(r) DESC "
+                                                 "SKIP {skip} LIMIT {limit}",
+                                                 {"terms": terms, "skip": skip, "limit": limit},
+                                                 operation="search"))[0]['data']
+        return [tuple(row['row']) for row in results]
+
+    def subtree(self, path, include_deleted=False):
+        """
+        Finds every file entity within a directory, at any depth, by looking up the indexed paths.  The results are
+        returned as an array of tuples, with each tuple consisting of the id of the file entity and its path, in order
+        of path.  For example::
+
+            [(31, "/experiments/2026/trial 1"),
+             (35, "/experiments/2026/trial 1/readings.csv")]
+
+        :param str path: The path of the directory, such as "/experiments/2026"
+        :param bool include_deleted: Whether to include file entities that have been deleted.  Defaults to False
+        :return: The file entities within the directory, not including the directory itself
+        :rtype: list[(int, str)]
+        """
+        statement = "MATCH (e:FILE_ENTITY) WHERE e.path STARTS WITH {prefix} "
+        if not include_deleted:
+            statement += "AND NOT (e) <-[:APPLIED_TO]- (:COMMAND {type: \"delete\"}) "
+        results = self.connection.post(Statement(statement + "RETURN id(e), e.path ORDER BY e.path",
+                                                 {"prefix": path.rstrip("/") + "/"}, operation="subtree"))[0]['data']
+        return [tuple(row['row']) for row in results]
+
+    def children(self, entity_id):
+        """
+        Finds the file entities directly contained by a directory.  The results are returned as an array of tuples,
+        with each tuple consisting of the id of the file entity and its name, in order of name.
+
+        :param int entity_id: The id of the directory's file entity
+        :return: The file entities within the directory
+        :rtype: list[(int, str)]
+        """
+        results = self.connection.post(Statement("MATCH (child:FILE_ENTITY) -[:CONTAINED]-> (parent) "
+                                                 "WHERE id(parent) = {} RETURN id(child), child.name "
+                                                 "ORDER BY child.name".format(entity_id),
+                                                 operation="subtree"))[0]['data']
+        return [tuple(row['row']) for row in results]
+
+    def command_columns(self):
+        """
+        Lists every command in the repository as columns, for analysis across the whole history.  The columns are
+        "revision", "command" and "entity", holding the ids of each command, the revision it occurred in and the
+        entity it applied to, and "type", holding the kind of command.  The id columns are typed arrays, so that
+        aggregates over them can be computed without visiting each command in turn.  For example, with NumPy::
+
+            columns = history.command_columns()
+            revisions, commands_per_revision = numpy.unique(columns["revision"], return_counts=True)
+
+        :rtype: dict[str, list | numpy.ndarray | array.array]
+        """
+        return self.connection.post_columnar(Statement("MATCH (r:REVISION) <-[:OCCURRED]- (c:COMMAND) "
+                                                       "-[:APPLIED_TO]-> (e) "
+                                                       "RETURN id(r) AS revision, id(c) AS command, "
+                                                       "id(e) AS entity, c.type AS type ORDER BY id(c)",
+                                                       operation="read"))[0]
+
+    def _compress(self, properties, key):
+        """
+        Compresses one of the properties of a node about to be created, tagging the node with the codec used
+
+        :param dict[str, any] properties: The properties of the node
+        :param str key: The name of the property to compress
+        """
+        properties[key], codec = compression.compress(properties[key], self.compression_codec,
+                                                      self.compression_threshold)
+        if codec is not None:
+            properties['codec'] = codec
+
+    def revision_commands(self, revision_id):
+        """
+        Finds the commands that occurred in a revision, along with their operations.  Payloads are returned as they
+        were before compression.  The results are returned as an array of tuples, with each tuple consisting of the id
+        of the command, the id of the entity it applied to, the command's properties, and a list of the properties of
+        its operations, in order.  For example::
+
+            [(21, 15, {"type": "create", "data": '{"filename":"File A"}'}, []),
+             (22, 16, {"type": "modify"}, [{"type": "insert", "content": "words", "location": 5}])]
+
+        Commands are only ever added to a revision as it is committed, so once a revision has commands it never
+        changes, and is cached.  The results are shared with the cache, and should not be modified.
+
+        :param int revision_id: The id of the revision
+        :return: The commands, in the order they were created
+        :rtype: list[(int, int, dict, list[dict])]
+        """
+        if self.cache is not None:
+            commands = self.cache.get(("revision", revision_id))
+            if commands is not None:
+                return commands
+        results = self.connection.post(Statement("MATCH (revision:REVISION) <-[:OCCURRED]- (c:COMMAND) "
+                                                 "-[:APPLIED_TO]-> (e) WHERE id(revision) = {} "
+                                                 "OPTIONAL MATCH (c) -[:FIRST_OP]-> (first:OPERATION) "
+                                                 "OPTIONAL MATCH p = (first) -[:NEXT_OP*0..]-> (last:OPERATION) "
+                                                 "WHERE NOT (last) -[:NEXT_OP]-> () "
+                                                 "RETURN id(c), id(e), c, nodes(p) ORDER BY id(c)"
+                                                 .format(revision_id), operation="read"))[0]['data']
+        commands = [(row['row'][0], row['row'][1],
+                     compression.decode_properties(row['row'][2], 'data'),
+                     [compression.decode_properties(operation, 'content') for operation in row['row'][3] or []])
+                    for row in results]
+        # A revision without commands may be the tip of a branch, still waiting for them
+        if self.cache is not None and commands:
+            self.cache.put(("revision", revision_id), commands,
+                           sum(_payload_size(properties, operations) for _, _, properties, operations in commands))
+        return commands
+
+    def file_content(self, entity_id, command_id=None):
+        """
+        Reconstructs the content of a file by replaying the commands applied to it: the content it was created with,
+        followed by the operations of each modification.  Content is expected to have been given as bytes, a file or
+        a path, and to be utf-8 text if it has been modified.  Commands are replayed in the order their revisions
+        occur in, following the chain of revisions back from the one ``command_id`` occurred in.
+
+        The content as of a given command never changes, and is cached.  So is the latest command applied to each
+        file, until the head branch moves, so a cached result needs no query at all.  Otherwise finding the latest
+        command costs one query, which follows the chain of revisions back to the first.
+
+        :param int entity_id: The id of the file entity
+        :param int command_id: The id of the last command to replay.  Defaults to the command in the latest revision
+        :return: The content of the file, or None if it had been deleted or the entity has no commands
+        :rtype: bytes
+        :raises ValueError: If the file is modified after it has been deleted
+        """
+        if command_id is None and self.cache is not None:
+            latest = self.cache.get(("latest", entity_id))
+            # The cache may be shared with histories that have seen the head branch elsewhere
+            if latest is not None and latest[0] == self.head:
+                command_id = latest[1]
+        if command_id is None:
+            latest = self.connection.post(Statement("MATCH (e) <-[:APPLIED_TO]- (c:COMMAND) -[:OCCURRED]-> "
+                                                    "(revision:REVISION) WHERE id(e) = {} "
+                                                    "MATCH p = (first:REVISION) -[:NEXT_COMMAND*0..]-> (revision) "
+                                                    "WHERE NOT (:REVISION) -[:NEXT_COMMAND]-> (first) "
+                                                    "RETURN id(c) ORDER BY length(p) DESC LIMIT 1"
+                                                    .format(entity_id), operation="read"))[0]['data']
+            if not latest:
+                return None
+            command_id = latest[0]['row'][0]
+            if self.cache is not None:
+                self.cache.put(("latest", entity_id), (self.head, command_id))
+                self._latest.add(entity_id)
+        if self.cache is not None:
+            content = self.cache.get(("content", entity_id, command_id))
+            if content is not None:
+                return content
+        # Ids are reused once nodes are deleted, so only the chain of revisions gives the order commands occurred in
+        results = self.connection.post(Statement("MATCH (target:COMMAND) -[:OCCURRED]-> (last:REVISION) "
+                                                 "WHERE id(target) = {1} "
+                                                 "MATCH chain = (revision:REVISION) -[:NEXT_COMMAND*0..]-> (last) "
+                                                 "MATCH (e) <-[:APPLIED_TO]- (c:COMMAND) -[:OCCURRED]-> (revision) "
+                                                 "WHERE id(e) = {0} "
+                                                 "OPTIONAL MATCH (c) -[:FIRST_OP]-> (first:OPERATION) "
+                                                 "OPTIONAL MATCH p = (first) -[:NEXT_OP*0..]-> (last_op:OPERATION) "
+                                                 "WHERE NOT (last_op) -[:NEXT_OP]-> () "
+                                                 "RETURN id(c), c, nodes(p) ORDER BY length(chain) DESC"
+                                                 .format(entity_id, command_id), operation="read"))[0]['data']
+        content = None
+        for row in results:
+            properties = compression.decode_properties(row['row'][1], 'data')
+            if properties['type'] == "create":
+                data = json.loads(properties['data'])
+                content = b64decode(data['content']) if 'content' in data else b""
+            elif properties['type'] == "delete":
+                content = None
+            else:
+                if content is None:
+                    raise ValueError("File entity {} is modified by command {} after it was deleted"
+                                     .format(entity_id, row['row'][0]))
+                operations = [compression.decode_properties(operation, 'content') for operation in row['row'][2]]
+                content = _apply_operations(content.decode("utf-8"), operations).encode("utf-8")
+        if self.cache is not None and content is not None:
+            self.cache.put(("content", entity_id, command_id), content, len(content))
+        return content
+
+    def commit(self, parent_revision=None):
         """
         Commit all commands that have been created so far.  Finishes this revision and advances to the next one
 
-        :param int parent_revision: The id of the revision that this commit is operating on
+        :param int parent_revision: The id of the revision that this commit is operating on.  Defaults to the
+                                    revision the head branch was last seen at
         :return: The id of the revision just committed and
                  a dictionary of temporary ids to their actual id for access in the application
         :rtype: (int, dict[str, int])
         """
         # TODO make sure that there have been commands performed, or don't do anything
-        match_statements = ["MATCH (revision:REVISION) WHERE id(revision) = {} ".format(parent_revision)] + \
-                           ["MATCH (e_{0}) WHERE id(e_{0}) = {0}".format(obj_id)
-                            for obj_id in self._lookup_ids]
+        if parent_revision is None:
+            parent_revision = self.head
+        statements = self._prepare_commit(parent_revision)
+        result = self._read_commit_results(self.connection.post(*statements), self._max_id - 1)
+        self._reset_pending()
+        return result
+
+    def prepare_revision(self, branch="head", commit_key=None):
+        """
+        Sets aside the commands created so far as a revision, to be committed later with :meth:`commit_prepared`.  The
+        revision is added to whichever revision is at the tip of ``branch`` when it is committed, so several prepared
+        revisions can be chained together within one transaction.  The pending commands are cleared, ready for the
+        next revision, so if the revision is never committed they are lost.
+
+        A revision given a commit key can be committed at most once: committing it again fails.  If the response to a
+        commit is lost, :meth:`find_committed` tells whether the revision made it into the database.
+
+        :param str branch: The name of the branch that the revision should be added to.  Defaults to "head"
+        :param str commit_key: A key identifying the revision, unique across the repository.  Optional
+        :return: The revision, ready to be committed
+        :rtype: :class:`PreparedRevision`
+        """
+        paths = {key[7:]: entity["path"] for key, entity in self._parameters.items()
+                 if key.startswith("entity_") and "path" in entity}
+        revision = PreparedRevision(self, self._prepare_commit(branch=branch, commit_key=commit_key), self._max_id - 1,
+                                    commit_key, paths)
+        self._reset_pending()
+        return revision
+
+    def commit_prepared(self, revisions, connection=None):
+        """
+        Commits revisions set aside by :meth:`prepare_revision` in a single transaction, in the order given.  The
+        revisions may have been prepared by other histories, and each history's branches are kept up to date with its
+        own revisions.
+
+        The transaction is sent straight away, but the results of each revision are read, and its history's branches
+        updated, as the returned iterator is advanced.  If the results of a revision can't be read, the iterator
+        raises, and the revisions after it are left unread, though they were committed.
+
+        :param list[PreparedRevision] revisions: The revisions to commit
+        :param connection: The connection to send the transaction through.  Defaults to this history's connection
+        :type connection: :class:`version_history.connection.Connection`
+        :return: For each revision, the id of the revision just committed and
+                 a dictionary of temporary ids to their actual id for access in the application
+        :rtype: collections.Iterator[(int, dict[str, int])]
+        """
+        connection = connection or self.connection
+        results = connection.post(*[statement for revision in revisions for statement in revision.statements])
+        return self._read_prepared_results(revisions, results)
+
+    def find_committed(self, commit_keys):
+        """
+        Finds the revisions that were committed with the given commit keys.  See :meth:`prepare_revision`.
+
+        :param list[str] commit_keys: The keys to look for
+        :return: For each key that was found, the id of the revision just committed and a dictionary of temporary ids
+                 to their actual id, just as the commit returned them
+        :rtype: dict[str, (int, dict[str, int])]
+        """
+        results = self.connection.post(Statement("MATCH (revision:REVISION) -[:NEXT_COMMAND]-> (next:REVISION) "
+                                                 "WHERE revision.commit_key IN {commit_keys} "
+                                                 "RETURN revision.commit_key, id(next), revision.commit_entities",
+                                                 {"commit_keys": list(commit_keys)}, operation="read",
+                                                 consistent=True))[0]['data']
+        return {commit_key: (revision, {"temp_{}".format(index + 1): entity_id
+                                        for index, entity_id in enumerate(entities or [])})
+                for commit_key, revision, entities in (row['row'] for row in results)}
+
+    @staticmethod
+    def _read_prepared_results(revisions, results):
+        """
+        Splits the results of a transaction from :meth:`commit_prepared` back out into each revision's own results
+        """
+        offset = 0
+        for revision in revisions:
+            revision_results = results[offset:offset + len(revision.statements)]
+            offset += len(revision.statements)
+            yield revision.history._read_commit_results(revision_results, revision.temp_count)
+
+    def _prepare_commit(self, parent_revision=None, branch=None, commit_key=None):
+        """
+        Builds the statements that will record the commands created so far as a new revision.  Either the parent
+        revision or the branch must be given.  When a branch is given, the commands are applied to whichever revision
+        is at the tip of that branch at the time the statements are executed, so that several revisions can be chained
+        together within one transaction.  The pending commands are left untouched.
+
+        :param int parent_revision: The id of the revision that this commit is operating on
+        :param str branch: The name of the branch whose current revision this commit is operating on
+        :param str commit_key: A key to record on the revision, along with the ids of the file entities it creates
+        :return: The statements to execute, in order
+        :rtype: list[:class:`version_history.connection.Statement`]
+        """
+        parameters = dict(self._parameters)
+        parameters_for_branch = {}
+        if branch is None:
+            revision_match = "MATCH (revision:REVISION) WHERE id(revision) = {} ".format(parent_revision)
+            advance_match = "MATCH (old_rev:REVISION)  WHERE id(old_rev) = {} " \
+                            "OPTIONAL MATCH (old_rev) -[a:AT]-> (branch:BRANCH) ".format(parent_revision)
+        else:
+            parameters["branch"] = parameters_for_branch["branch"] = branch
+            revision_match = "MATCH (:BRANCH {name: {branch}}) <-[:AT]- (revision:REVISION) "
+            advance_match = "MATCH (branch:BRANCH {name: {branch}}) <-[a:AT]- (old_rev:REVISION) "
+        match_statements = [revision_match]
+        for obj_id in self._lookup_ids:
+            if isinstance(obj_id, EntityReference):
+                # The revision that created the entity may be earlier in this same transaction
+                parameters["key_" + obj_id.name] = obj_id.commit_key
+                match_statements.append("MATCH (r_{0}:REVISION {{commit_key: {{key_{0}}}}}) "
+                                        "MATCH (e_{0}) WHERE id(e_{0}) = r_{0}.commit_entities[{1}]"
+                                        .format(obj_id.name, int(obj_id.temp_id[5:]) - 1))
+            else:
+                match_statements.append("MATCH (e_{0}) WHERE id(e_{0}) = {0}".format(obj_id))
         return_clauses = ["id(e_temp_{})".format(new_id) for new_id in range(1, self._max_id)]
-        merged_statement = "\n".join(match_statements + self._statements)
+        key_statements = []
+        if commit_key is not None:
+            parameters["commit_key"] = commit_key
+            key_statements.append("SET revision.commit_key = {commit_key}")
+            if return_clauses:
+                key_statements[0] += ", revision.commit_entities = [" + ",".join(return_clauses) + "]"
+        merged_statement = "\n".join(match_statements + self._statements + key_statements)
         if len(return_clauses):
             merged_statement += "\nRETURN " + ",".join(return_clauses)
-        print("----")
-        print(merged_statement)
-        results = self.connection.post(Statement(merged_statement, self._parameters),
-                                       Statement("MATCH (old_rev:REVISION)  WHERE id(old_rev) = {} "
-                                                 .format(parent_revision) +
-                                                 "OPTIONAL MATCH (old_rev) -[a:AT]-> (branch:BRANCH) "
-                                                 "CREATE (branch) <-[:AT]- (n:REVISION) <-[:NEXT_COMMAND]- (old_rev) "
-                                                 "DELETE a "
-                                                 "RETURN id(n) "))
-        mapping = {"temp_{}".format(i + 1): results[0]['data'][0]['row'][i] for i in range(self._max_id - 1)}
+        _logger.debug("Committing revision:\n%s", merged_statement)
+        command_types = sorted({value['type'] for key, value in self._parameters.items() if key.startswith("command_")})
+        statements = [Statement(merged_statement, parameters, self._streams,
+                                "+".join(command_types) if command_types else "annotate")]
+        if self._terms:
+            # The unique constraint on TERM text is what keeps concurrent commits from each creating the same term
+            statements.append(Statement(revision_match +
+                                        "UNWIND {terms} AS term "
+                                        "MERGE (t:TERM {text: term.text}) "
+                                        "ON CREATE SET t.revisions = 1 "
+                                        "ON MATCH SET t.revisions = t.revisions + 1 "
+                                        "CREATE (t) -[:INDEXES {count: term.count}]-> (revision)",
+                                        dict(parameters_for_branch,
+                                             terms=[{"text": text, "count": count}
+                                                    for text, count in sorted(self._terms.items())]),
+                                        operation="index"))
+        statements.append(Statement(advance_match +
+                                    "CREATE (branch) <-[:AT]- (n:REVISION) <-[:NEXT_COMMAND]- (old_rev) "
+                                    "DELETE a "
+                                    "RETURN id(n), branch.name", parameters_for_branch or None,
+                                    operation="advance branch"))
+        return statements
+
+    def _read_commit_results(self, results, temp_count):
+        """
+        Interprets the results of executing the statements from :meth:`_prepare_commit`, and records where the
+        branch that was advanced now points
+
+        :param results: The results of the statements, as returned by the connection
+        :param int temp_count: The number of temporary ids that were handed out for the revision
+        :return: The id of the revision just committed and a dictionary of temporary ids to their actual id
+        :rtype: (int, dict[str, int])
+        """
+        mapping = {"temp_{}".format(i + 1): results[0]['data'][0]['row'][i] for i in range(temp_count)}
+        revision, branch = results[-1]['data'][0]['row']
+        if branch is not None:
+            self.branches[branch] = revision
+            if branch == "head":
+                self._forget_latest()
+        return revision, mapping
+
+    def _forget_latest(self):
+        """
+        Discards the latest commands cached by this history, as the head branch has moved past them
+        """
+        for entity_id in self._latest:
+            self.cache.invalidate(("latest", entity_id))
+        self._latest = set()
+
+    def _reset_pending(self):
+        """
+        Discards the commands created so far, ready for the next revision
+        """
         self._statements = []
         self._parameters = {}
+        self._streams = {}
         self._max_id = 1
         self._lookup_ids = set()
-        return results[1]['data'][0]['row'][0], mapping
+        self._terms = Counter()
+
+
+def _apply_operations(text, operations):
+    """
+    Applies insert and remove operations to some text, in order
+
+    :param str text: The text before the operations
+    :param list[dict[str, any]] operations: The operations
+    :return: The text after the operations
+    :rtype: str
+    """
+    for operation in operations:
+        location = operation['location']
+        if operation['type'] == 'insert':
+            text = text[:location] + operation['content'] + text[location:]
+        else:
+            text = text[:location] + text[location + operation['length']:]
+    return text
+
+
+def _payload_size(properties, operations):
+    """
+    Roughly how many bytes a command's payloads take up, for bounding the size of the cache
+    """
+    return len(properties.get('data', "")) + sum(len(operation.get('content', "")) for operation in operations)
+
+
+class PreparedRevision:
+    __slots__ = ['history', 'statements', 'temp_count', 'commit_key', 'paths']
+
+    def __init__(self, history, statements, temp_count, commit_key=None, paths=None):
+        """
+        A revision set aside by :meth:`History.prepare_revision`, waiting to be committed
+
+        :param history: The repository the revision came from
+        :type history: :class:`History`
+        :param list statements: The statements that will record the revision
+        :param int temp_count: The number of temporary ids handed out for the revision
+        :param str commit_key: The key the revision will be committed with, if any
+        :param dict[str, str] paths: The path of each file entity the revision creates, keyed by temporary id
+        """
+        self.history = history
+        self.statements = statements
+        self.temp_count = temp_count
+        self.commit_key = commit_key
+        self.paths = paths or {}
+
+    def entity(self, temp_id):
+        """
+        Refers to a file entity this revision creates, so that revisions prepared after it can use the entity before
+        its id is known, even within the same transaction.  The reference can be given wherever the id of a committed
+        file entity can.  Only revisions with a commit key can be referred to.
+
+        :param str temp_id: The temporary id the entity was given in this revision
+        :rtype: :class:`EntityReference`
+        """
+        if self.commit_key is None:
+            raise ValueError("Only revisions with a commit key can be referred to before they are committed")
+        return EntityReference(self.commit_key, temp_id, self.paths.get(temp_id))
+
+
+class EntityReference:
+    __slots__ = ['commit_key', 'temp_id', 'path', 'name']
+
+    def __init__(self, commit_key, temp_id, path=None):
+        """
+        Refers to a file entity by the commit key of the revision that created it and its temporary id there.  See
+        :meth:`PreparedRevision.entity`.
+
+        :param str commit_key: The commit key of the revision that created the entity
+        :param str temp_id: The temporary id the entity was given in that revision
+        :param str path: The path of the entity, if it has one
+        """
+        self.commit_key = commit_key
+        self.temp_id = temp_id
+        self.path = path
+        #: Names the entity within statements, which only allow some characters
+        self.name = "ref_" + sha256("{}\n{}".format(commit_key, temp_id).encode("utf-8")).hexdigest()[:16]
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, EntityReference) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
@@ -0,0 +1,394 @@
+from base64 import b64decode, b64encode
+from codecs import decode
+import json
+import logging
+import os
+from pathlib import Path
+import re
+from threading import Event, Lock, Thread
+from uuid import uuid4
+
+
+_logger = logging.getLogger(__name__)
+
+#: Matches the ids handed out by a journal: the sequence number of the revision, and the temporary id within it
+_JOURNAL_ID = re.compile(r"^j(\d+)_(temp_\d+)$")
+
+
+class Journal:
+    def __init__(self, directory):
+        """
+        Records commands to an append-only journal on the local disk, so that they can be captured without the
+        database being reachable.  It offers the same methods for recording commands as
+        :class:`version_history.history.History`, and a :class:`Syncer` replays the journal to the database later.
+
+        Committing writes the revision to the journal and flushes it to disk before returning.  File content is copied
+        into the journal's directory, so the originals may change or disappear once the revision is committed.
+
+        The ids handed out by :meth:`create_file` look like ``j12_temp_1``, and can be used in later commands whether
+        or not their revision has been synced.  Once it has, :meth:`resolve` gives the id in the database.
+
+        Each journal is given a random id when it is created, so that the revisions it holds can be told apart from
+        those of any other journal synced to the same database.
+
+        :param str directory: The directory holding the journal.  Created if it doesn't exist, and reopened if it does
+        """
+        self.directory = Path(directory)
+        (self.directory / "blobs").mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        #: The revisions that have been committed to the journal but not synced, in order
+        self._unsynced = []
+        #: The id in the database of each journal id that has been synced
+        self._mapping = {}
+        self._sequence = 1
+        #: Identifies this journal among any others synced to the same database
+        self.journal_id = None
+        log = self.directory / "journal.log"
+        if log.exists():
+            with open(log, "r+b") as reader:
+                complete = 0
+                for line in reader:
+                    if not line.endswith(b"\n"):
+                        break
+                    complete += len(line)
+                    self._replay_record(json.loads(line.decode("utf-8"), object_hook=_decode_bytes))
+                # A torn final line means the process died mid write; that revision was never committed, and it's
+                # cut off so that the next record doesn't land on the end of it
+                if reader.tell() > complete:
+                    reader.truncate(complete)
+                    os.fsync(reader.fileno())
+        self._log = open(log, "a", encoding="utf-8")
+        if self.journal_id is None:
+            self.journal_id = uuid4().hex
+            self._append({"type": "journal", "id": self.journal_id})
+
+        #: The commands recorded so far for this revision
+        self._commands = []
+        self._max_id = 1
+
+    def _replay_record(self, record):
+        """
+        Updates the state of the journal from a record read back from disk
+        """
+        if record["type"] == "journal":
+            self.journal_id = record["id"]
+        elif record["type"] == "revision":
+            self._unsynced.append(record)
+            self._sequence = record["sequence"] + 1
+        else:
+            self._unsynced = [pending for pending in self._unsynced if pending["sequence"] != record["sequence"]]
+            self._mapping.update(record["mapping"])
+
+    def create_file(self, parent=None, /, **data):
+        """
+        Records a new file creation command.  See :meth:`version_history.history.History.create_file`.  File objects
+        and paths are copied into the journal a chunk at a time.
+
+        :return: The journal id of this file
+        :rtype: str
+        """
+        new_id = "j{}_temp_{}".format(self._sequence, self._max_id)
+        for key, value in data.items():
+            if isinstance(value, os.PathLike) or hasattr(value, "read"):
+                data[key] = {"$blob": self._copy_blob(value, "{}_{}".format(new_id, key))}
+        self._max_id += 1
+        self._commands.append({"command": "create", "id": new_id, "parent": parent, "data": data})
+        return new_id
+
+    def delete_file(self, file_id):
+        """
+        Records a file deletion command.  See :meth:`version_history.history.History.delete_file`.
+        """
+        self._commands.append({"command": "delete", "id": file_id})
+
+    def modify_file(self, file_id, *operations):
+        """
+        Records a file modification command.  See :meth:`version_history.history.History.modify_file`.
+        """
+        self._commands.append({"command": "modify", "id": file_id, "operations": list(operations)})
+
+    def annotate(self, text):
+        """
+        Records an annotation for this revision.  See :meth:`version_history.history.History.annotate`.
+        """
+        self._commands.append({"command": "annotate", "text": text})
+
+    def commit(self, branch="head"):
+        """
+        Commits the commands recorded so far to the journal, to be added to the tip of ``branch`` when synced.
+        Returns once the revision is safely on disk.
+
+        :param str branch: The name of the branch that the revision should be added to.  Defaults to "head"
+        :return: The sequence number of the revision in the journal, and
+                 a dictionary of temporary ids to their journal ids
+        :rtype: (int, dict[str, str])
+        """
+        record = {"type": "revision", "sequence": self._sequence, "branch": branch, "commands": self._commands}
+        self._append(record)
+        with self._lock:
+            self._unsynced.append(record)
+        mapping = {"temp_{}".format(index): "j{}_temp_{}".format(self._sequence, index)
+                   for index in range(1, self._max_id)}
+        self._sequence += 1
+        self._commands = []
+        self._max_id = 1
+        return record["sequence"], mapping
+
+    def resolve(self, journal_id):
+        """
+        Gives the id in the database of a file created through the journal
+
+        :param str journal_id: The id handed out by :meth:`create_file`
+        :return: The id in the database, or None if the file's revision hasn't been synced yet
+        :rtype: int
+        """
+        with self._lock:
+            return self._mapping.get(journal_id)
+
+    def unsynced(self):
+        """
+        :return: The revisions waiting to be synced, in order
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return list(self._unsynced)
+
+    def mark_synced(self, sequence, revision, mapping):
+        """
+        Records that a revision has been added to the database
+
+        :param int sequence: The sequence number of the revision in the journal
+        :param int revision: The id of the revision in the database
+        :param dict[str, int] mapping: The id in the database of each journal id created in the revision
+        """
+        self._append({"type": "synced", "sequence": sequence, "revision": revision, "mapping": mapping})
+        with self._lock:
+            self._replay_record({"type": "synced", "sequence": sequence, "mapping": mapping})
+        # The database has its own copy of the content now
+        for blob in (self.directory / "blobs").glob("j{}_*".format(sequence)):
+            blob.unlink()
+
+    def close(self):
+        """
+        Closes the journal's file.  Commands recorded but not committed are lost.
+        """
+        self._log.close()
+
+    def _append(self, record):
+        """
+        Writes a record to the end of the journal, and waits for it to reach the disk
+        """
+        line = json.dumps(record, separators=(",", ":"), sort_keys=True, default=_encode_bytes) + "\n"
+        with self._lock:
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def _copy_blob(self, source, name, chunk_size=3 * 1024 * 1024):
+        """
+        Copies file content into the journal's directory, a chunk at a time
+
+        :param source: A path to the file, or a binary file object positioned at the start of the content
+        :param str name: The name to give the copy
+        :return: The path of the copy, relative to the journal's directory
+        :rtype: str
+        """
+        relative = os.path.join("blobs", name)
+        reader = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+        try:
+            with open(self.directory / relative, "wb") as writer:
+                chunk = reader.read(chunk_size)
+                while chunk:
+                    writer.write(chunk)
+                    chunk = reader.read(chunk_size)
+                writer.flush()
+                os.fsync(writer.fileno())
+        finally:
+            if reader is not source:
+                reader.close()
+        return relative
+
+
+class Syncer:
+    def __init__(self, journal, history, batch_size=100, retry_interval=5.0):
+        """
+        Replays the revisions in a journal to the database, in the order they were committed.  Consecutive revisions
+        are sent together, up to ``batch_size`` at a time, in a single transaction.  A revision that refers to a file
+        created earlier in the same batch starts a new batch, since the file's id isn't known until the earlier one
+        has been sent.
+
+        If the connection fails partway through a transaction, the database rolls it back and the batch is sent
+        again.  Each revision is committed with a key made of the journal's id and the revision's sequence number, so
+        if a response is lost after the database committed the batch, its revisions are found and marked as synced
+        rather than sent twice.  The same check is made the first time a syncer runs, in case an earlier process
+        stopped in the same place.
+
+        :param journal: The journal to replay
+        :type journal: :class:`Journal`
+        :param history: The repository to replay the journal into
+        :type history: :class:`version_history.history.History`
+        :param int batch_size: The most revisions to send in one transaction.  Defaults to 100
+        :param float retry_interval: How long, in seconds, to wait after a failure before trying again.  Defaults to 5
+        """
+        self.journal = journal
+        self.history = history
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._stopping = Event()
+        self._thread = None
+        #: Whether revisions may have been committed without being marked as synced
+        self._unconfirmed = True
+
+    def sync(self):
+        """
+        Replays every revision waiting in the journal
+
+        :return: The number of revisions synced
+        :rtype: int
+        """
+        synced = self._confirm() if self._unconfirmed else 0
+        batch = []
+        for record in self.journal.unsynced():
+            if len(batch) >= self.batch_size or self._depends_on(record, batch):
+                synced += self._send(batch)
+                batch = []
+            batch.append(record)
+        if batch:
+            synced += self._send(batch)
+        return synced
+
+    def start(self, interval=1.0):
+        """
+        Starts replaying the journal in the background, every ``interval`` seconds
+
+        :param float interval: How long, in seconds, to wait between syncs.  Defaults to 1
+        """
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops replaying the journal in the background, after the current sync has finished
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+                self._stopping.wait(interval)
+            except Exception:
+                _logger.warning("Syncing the journal failed, retrying in %s seconds", self.retry_interval,
+                                exc_info=True)
+                self._stopping.wait(self.retry_interval)
+
+    @staticmethod
+    def _depends_on(record, batch):
+        """
+        Whether a revision refers to a file created by one of the revisions in a batch
+        """
+        sequences = {pending["sequence"] for pending in batch}
+        for command in record["commands"]:
+            for file_id in (command.get("id"), command.get("parent")):
+                match = _JOURNAL_ID.match(file_id) if isinstance(file_id, str) else None
+                if match and int(match.group(1)) in sequences and int(match.group(1)) != record["sequence"]:
+                    return True
+        return False
+
+    def _confirm(self):
+        """
+        Marks as synced the waiting revisions that are already in the database
+
+        :return: The number of revisions marked as synced
+        :rtype: int
+        """
+        records = self.journal.unsynced()
+        committed = self.history.find_committed([self._commit_key(record) for record in records]) if records else {}
+        for record in records:
+            if self._commit_key(record) in committed:
+                self._mark_synced(record, *committed[self._commit_key(record)])
+        if committed:
+            # The branches have moved on since the history last saw them
+            self.history.refresh()
+        self._unconfirmed = False
+        return len(committed)
+
+    def _commit_key(self, record):
+        """
+        The key that identifies a journaled revision in the database
+        """
+        return "{}:{}".format(self.journal.journal_id, record["sequence"])
+
+    def _mark_synced(self, record, revision, mapping):
+        """
+        Records in the journal that a revision has been added to the database, given the results of its commit
+        """
+        self.journal.mark_synced(record["sequence"], revision,
+                                 {"j{}_{}".format(record["sequence"], temp_id): entity_id
+                                  for temp_id, entity_id in mapping.items()})
+
+    def _send(self, batch):
+        """
+        Sends a batch of revisions to the database in a single transaction, and records that they have been synced
+        """
+        prepared = []
+        for record in batch:
+            self._replay(record)
+            prepared.append(self.history.prepare_revision(record["branch"], self._commit_key(record)))
+        self._unconfirmed = True
+        for record, (revision, mapping) in zip(batch, self.history.commit_prepared(prepared)):
+            self._mark_synced(record, revision, mapping)
+        self._unconfirmed = False
+        return len(batch)
+
+    def _replay(self, record):
+        """
+        Records the commands of a journaled revision in the history, translating journal ids as it goes
+        """
+        def resolve(file_id):
+            match = _JOURNAL_ID.match(file_id) if isinstance(file_id, str) else None
+            if match is None:
+                return file_id
+            if int(match.group(1)) == record["sequence"]:
+                # Files created in the same revision keep the same temporary id when replayed
+                return match.group(2)
+            resolved = self.journal.resolve(file_id)
+            if resolved is None:
+                raise ValueError("{} refers to a revision that hasn't been synced".format(file_id))
+            return resolved
+
+        for command in record["commands"]:
+            if command["command"] == "create":
+                data = {key: self.journal.directory / value["$blob"]
+                        if isinstance(value, dict) and "$blob" in value else value
+                        for key, value in command["data"].items()}
+                parent = command["parent"]
+                self.history.create_file(resolve(parent) if parent is not None else None, **data)
+            elif command["command"] == "delete":
+                self.history.delete_file(resolve(command["id"]))
+            elif command["command"] == "modify":
+                self.history.modify_file(resolve(command["id"]), *command["operations"])
+            else:
+                self.history.annotate(command["text"])
+
+
+def _encode_bytes(value):
+    """
+    Stores bytes within the journal's json, so that they can be told apart from text when read back
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": decode(b64encode(value), "ascii")}
+    raise TypeError("{} can't be stored in the journal".format(type(value).__name__))
+
+
+def _decode_bytes(value):
+    """
+    Reverses :func:`_encode_bytes` as the journal's json is read back
+    """
+    if len(value) == 1 and "$bytes" in value:
+        return b64decode(value["$bytes"])
+    return value
@@ -0,0 +1,156 @@
+from io import StringIO
+import re
+from threading import Lock
+from version_history.connection import Statement
+
+
+#: Matches the parts of a statement that vary between uses of the same template: node ids and temporary ids
+_VARYING = re.compile(r"(?<![A-Za-z])\d+")
+
+
+class Profiler:
+    #: Statements performing these operations can't be profiled, and are run as they are
+    UNPROFILED = {"schema"}
+
+    def __init__(self, mode="PROFILE"):
+        """
+        Collects the query plans of the statements sent through a connection, and aggregates them by the kind of
+        operation each statement performs.  Attach it to a connection with
+        :attr:`version_history.connection.Connection.profiler`.
+
+        Under "PROFILE" statements are executed as normal, and the plan records the database hits and rows of each
+        operator.  Under "EXPLAIN" statements are planned but not executed, so nothing is written and no results are
+        returned; this suits inspecting read statements, but not committing revisions.
+
+        :param str mode: Either "PROFILE" or "EXPLAIN".  Defaults to "PROFILE"
+        """
+        if mode not in ("PROFILE", "EXPLAIN"):
+            raise ValueError("Unknown profiling mode: {}".format(mode))
+        self.mode = mode
+        self._lock = Lock()
+        #: The statistics gathered so far, keyed by operation
+        self._operations = {}
+
+    def prepare(self, statement):
+        """
+        Gives a copy of a statement that will be run under this profiler's mode
+
+        :param statement: The statement to be run
+        :type statement: :class:`version_history.connection.Statement`
+        :rtype: :class:`version_history.connection.Statement`
+        """
+        if statement.operation in self.UNPROFILED:
+            return statement
+        return Statement(self.mode + " " + statement.statement, statement.parameters, statement.streams,
+                         statement.operation, statement.consistent)
+
+    def record(self, statement, result):
+        """
+        Adds the query plan returned for a statement to the statistics
+
+        :param statement: The statement as it was given to the connection, before being prepared
+        :type statement: :class:`version_history.connection.Statement`
+        :param dict result: The result of the statement, as returned by the database
+        """
+        if 'plan' not in result:
+            return
+        root = result['plan']['root']
+        template = _VARYING.sub("?", statement.statement)
+        operators = {}
+        db_hits = _walk_plan(root, operators)
+        rows = _plan_value(root, "Rows", _plan_value(root, "EstimatedRows", 0))
+        with self._lock:
+            statistics = self._operations.setdefault(statement.operation or "other", {
+                "statements": 0,
+                "db_hits": 0,
+                "rows": 0,
+                "operators": {},
+                "templates": {},
+            })
+            statistics["statements"] += 1
+            statistics["db_hits"] += db_hits
+            statistics["rows"] += rows
+            for operator, hits in operators.items():
+                statistics["operators"][operator] = statistics["operators"].get(operator, 0) + hits
+            template_statistics = statistics["templates"].setdefault(template, {"statements": 0, "db_hits": 0})
+            template_statistics["statements"] += 1
+            template_statistics["db_hits"] += db_hits
+
+    def report(self):
+        """
+        Gives the statistics gathered so far.  For each operation, the number of statements profiled, the total
+        database hits and rows, the database hits of each kind of planner operator, and the statements and database
+        hits of each statement template.  Templates are statements with their ids replaced by ``?``.  For example::
+
+            {
+              "advance branch": {
+                "statements": 2,
+                "db_hits": 14,
+                "rows": 2,
+                "operators": {"NodeByIdSeek": 2, "Expand(All)": 6, "CreateNode": 4, "Delete": 2},
+                "templates": {"MATCH (old_rev:REVISION)  WHERE id(old_rev) = ? ...": {"statements": 2, "db_hits": 14}}
+              }
+            }
+
+        :rtype: dict[str, dict[str, any]]
+        """
+        with self._lock:
+            return {operation: {
+                "statements": statistics["statements"],
+                "db_hits": statistics["db_hits"],
+                "rows": statistics["rows"],
+                "operators": dict(statistics["operators"]),
+                "templates": {template: dict(template_statistics)
+                              for template, template_statistics in statistics["templates"].items()},
+            } for operation, statistics in self._operations.items()}
+
+    def format_report(self, operators=3):
+        """
+        Describes the statistics gathered so far as text, with the most expensive operations first
+
+        :param int operators: How many of the most expensive operators to list for each operation
+        :rtype: str
+        """
+        output = StringIO()
+        report = self.report()
+        for operation in sorted(report, key=lambda name: report[name]["db_hits"], reverse=True):
+            statistics = report[operation]
+            output.write("{}: {} statements, {} db hits, {} rows\n".format(operation, statistics["statements"],
+                                                                          statistics["db_hits"], statistics["rows"]))
+            costliest = sorted(statistics["operators"].items(), key=lambda item: item[1], reverse=True)
+            for operator, hits in costliest[:operators]:
+                output.write("    {}: {} db hits\n".format(operator, hits))
+        return output.getvalue()
+
+    def reset(self):
+        """
+        Discards the statistics gathered so far
+        """
+        with self._lock:
+            self._operations = {}
+
+
+def _plan_value(operator, key, default):
+    """
+    Reads a figure from an operator of a query plan.  Depending on the version of the database, figures are either
+    properties of the operator themselves or gathered under its "arguments"
+    """
+    if key in operator:
+        return operator[key]
+    return operator.get("arguments", {}).get(key, default)
+
+
+def _walk_plan(operator, operators):
+    """
+    Totals the database hits of an operator and all of its children, by type of operator
+
+    :param dict operator: The operator at the root of the plan
+    :param dict[str, int] operators: The database hits of each type of operator, added to as the plan is walked
+    :return: The total database hits
+    :rtype: int
+    """
+    hits = _plan_value(operator, "DbHits", 0)
+    operators[operator["operatorType"]] = operators.get(operator["operatorType"], 0) + hits
+    for child in operator.get("children", []):
+        hits += _walk_plan(child, operators)
+    return hits
@@ -0,0 +1,198 @@
+import re
+from threading import Lock
+import time
+import requests
+from urllib3.exceptions import NewConnectionError
+from version_history.connection import Connection
+
+
+#: Matches the clauses that make a statement write to the database.  Procedure calls might write, so they count too
+_WRITE_CLAUSE = re.compile(r"\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|FOREACH|LOAD\s+CSV|CALL)\b", re.IGNORECASE)
+
+
+class RoutingConnection(Connection):
+    def __init__(self, username, password, endpoints, path='db/data', profiler=None, retry_interval=5.0,
+                 timeout=5.0, transaction_timeout=None):
+        """
+        A connection to a cluster of databases.  Transactions that write, or that must see every transaction committed
+        so far, are sent to the leader, while other read only transactions are spread across the other members in turn,
+        though they may not have caught up with the leader yet.  The leader is found through each member's high
+        availability status, at ``/db/manage/server/ha/master``.
+
+        Members that can't be reached, or that answer with an error, are skipped until ``retry_interval`` seconds have
+        passed, and read only transactions move on to the next member.  If the leader can't be reached, the members are
+        checked again to find the new one.  A writing transaction is only sent to the new leader if it never reached
+        the old one; once it has been sent, a failure is raised, since the old leader may have committed it.  No
+        requests will be made until one of the methods are called.
+
+        :param str username: The username to use for connecting to the databases.  Required
+        :param str password: The password for connecting to the databases.  Required
+        :param endpoints: The host and port of each member of the cluster.  Required
+        :type endpoints: list[(str, int)]
+        :param str path: The path the database is located at on each member.  Defaults to 'db/data'
+        :param profiler: If given, every statement is run under the profiler's mode, and its query plan recorded
+        :type profiler: :class:`version_history.profiling.Profiler`
+        :param float retry_interval: How long, in seconds, to leave an unreachable member before trying it again.
+                                     Defaults to 5
+        :param float timeout: How long, in seconds, to wait when checking a member's status, and when connecting to a
+                              member to run a transaction.  Defaults to 5
+        :param float transaction_timeout: How long, in seconds, to wait for a transaction's response once it has been
+                                          sent.  A transaction that takes longer fails, without the member being
+                                          marked as unreachable.  Defaults to waiting as long as it takes
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        super().__init__(username, password, endpoints[0][0], endpoints[0][1], path, profiler)
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.transaction_timeout = transaction_timeout
+        self._endpoints = [_Endpoint(host, port, path) for host, port in endpoints]
+        self._lock = Lock()
+        #: The member currently believed to be the leader, or None if it isn't known
+        self._leader = None
+        #: Where the next read only transaction should start looking for a member
+        self._next_read = 0
+        #: When the members were last checked, or None if they never have been
+        self._checked_at = None
+
+    def check_health(self):
+        """
+        Asks each member of the cluster whether it is available, and whether it is the leader
+
+        :return: The host and port of the leader, or None if no member is
+        :rtype: (str, int)
+        """
+        leader = None
+        for endpoint in self._endpoints:
+            try:
+                response = requests.get(endpoint.status_url, auth=(self._username, self._password),
+                                        timeout=self.timeout)
+            except requests.RequestException:
+                self._mark_down(endpoint)
+                continue
+            endpoint.down_since = None
+            # Members answer 200 if they are the leader, and 404 if they are not
+            if response.status_code == 200 and leader is None:
+                leader = endpoint
+        with self._lock:
+            self._leader = leader
+            self._checked_at = time.monotonic()
+        return (leader.host, leader.port) if leader is not None else None
+
+    def _send(self, statements, body):
+        """
+        Sends the body of a request to a member of the cluster, trying others if it can't be reached
+        """
+        writes = any(_WRITE_CLAUSE.search(statement.statement) for statement in statements)
+        if writes or any(statement.consistent for statement in statements):
+            candidates = self._write_candidates
+        else:
+            candidates = self._read_candidates
+        for endpoint in candidates():
+            if not isinstance(body, str):
+                # A streamed body can only be read once, so each attempt needs a fresh one
+                body = self._iter_body(statements)
+            try:
+                response = requests.post(endpoint.url, body, auth=(self._username, self._password),
+                                         timeout=(self.timeout, self.transaction_timeout))
+            except requests.ReadTimeout as error:
+                # A slow transaction would be just as slow anywhere else, and says nothing about the member's health
+                raise TimeoutError("A transaction got no response within {} seconds{}".format(
+                    self.transaction_timeout, ", so it may or may not have been committed" if writes else "")) \
+                    from error
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if writes and not _never_sent(error):
+                    raise ConnectionError("The leader stopped responding after a transaction was sent to it, so it may "
+                                          "or may not have been committed: {}".format(error)) from error
+                self._mark_down(endpoint)
+                continue
+            try:
+                result = response.json() if response.ok else None
+            except ValueError:
+                result = None
+            if result is not None:
+                return result
+            if writes:
+                raise ConnectionError("The leader answered a transaction with {} {}, so it may or may not have been "
+                                      "committed".format(response.status_code, response.reason))
+            # A member still catching up, or otherwise unwell, may answer without being able to run the transaction
+            self._mark_down(endpoint)
+        raise ConnectionError("No database in the cluster could be reached")
+
+    def _write_candidates(self):
+        """
+        Generates the members that a writing transaction should be sent to: the leader, and if it can't be reached,
+        whichever member has taken its place
+        """
+        leader = self._leader
+        if leader is None or not self._is_available(leader):
+            self.check_health()
+            leader = self._leader
+        if leader is None:
+            return
+        yield leader
+        self.check_health()
+        if self._leader is not None and self._leader is not leader:
+            yield self._leader
+
+    def _read_candidates(self):
+        """
+        Generates the members that a read only transaction should be sent to, in order.  The followers come first,
+        starting with the one after the follower used last, and the leader comes last
+        """
+        if self._leader is None and (self._checked_at is None or
+                                     time.monotonic() - self._checked_at >= self.retry_interval):
+            self.check_health()
+        leader = self._leader
+        followers = [endpoint for endpoint in self._endpoints if endpoint is not leader]
+        with self._lock:
+            start = self._next_read % len(followers) if followers else 0
+            self._next_read = start + 1
+        for endpoint in followers[start:] + followers[:start] + ([leader] if leader is not None else []):
+            if self._is_available(endpoint):
+                yield endpoint
+
+    def _is_available(self, endpoint):
+        """
+        Whether a member is worth trying: either it hasn't failed, or it failed long enough ago to try again
+        """
+        down_since = endpoint.down_since
+        return down_since is None or time.monotonic() - down_since >= self.retry_interval
+
+    def _mark_down(self, endpoint):
+        """
+        Records that a member couldn't be reached
+        """
+        with self._lock:
+            endpoint.down_since = time.monotonic()
+            if endpoint is self._leader:
+                self._leader = None
+
+
+class _Endpoint:
+    __slots__ = ['host', 'port', 'url', 'status_url', 'down_since']
+
+    def __init__(self, host, port, path):
+        """
+        A member of a cluster of databases
+
+        :param str host: The hostname of the member
+        :param int port: The port the member is listening on
+        :param str path: The path the database is located at
+        """
+        self.host = host
+        self.port = port
+        self.url = "http://{}:{}/{}/transaction/commit".format(host, port, path)
+        self.status_url = "http://{}:{}/db/manage/server/ha/master".format(host, port)
+        #: When the member last failed to respond, or None if it has been responding
+        self.down_since = None
+
+
+def _never_sent(error):
+    """
+    Whether a request failed before the connection was made, so that the server can't have received it
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)